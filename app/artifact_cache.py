@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from time import time
+
+log = logging.getLogger('artifact_cache')
+
+# check disk size every n writes
+TRIM_EVERY = 100
+
+
+class ArtifactCache:
+    """Immutable artifacts by key, memory LRU over a zlib SQLite store.
+
+    `memory_bytes` and `disk_bytes` bound the text and compressed sizes,
+    oldest entries are evicted first. `path` None keeps memory only.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        memory_bytes: int = 32 * 1024 * 1024,
+        disk_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        # {key: text}, least recently used first
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._writes = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS artifact ('
+                'key TEXT PRIMARY KEY, data BLOB NOT NULL, created_at INTEGER NOT NULL)'
+            )
+            self._db.commit()
+
+    #
+    # Cached value or fetch() result
+    #
+    def get_or_fetch(self, key: str, fetch) -> str:
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+
+            if self._db is None:
+                return None
+
+            row = self._db.execute(
+                'SELECT data FROM artifact WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value = zlib.decompress(row[0]).decode()
+            self._remember(key, value)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value)
+
+            if self._db is None:
+                return
+
+            self._db.execute(
+                'INSERT OR REPLACE INTO artifact (key, data, created_at) VALUES (?, ?, ?)',
+                (key, zlib.compress(value.encode()), int(time())),
+            )
+            self._db.commit()
+
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                self._trim()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # under _lock
+    def _remember(self, key: str, value: str) -> None:
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    # under _lock
+    def _trim(self) -> None:
+        size = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM artifact'
+        ).fetchone()[0]
+        if size <= self.disk_bytes:
+            return
+
+        # drop the oldest down to 90%
+        excess = size - int(self.disk_bytes * 0.9)
+        removed = 0
+        keys = []
+        for key, length in self._db.execute(
+            'SELECT key, LENGTH(data) FROM artifact ORDER BY created_at'
+        ).fetchall():
+            if removed >= excess:
+                break
+            keys.append((key,))
+            removed += length
+
+        self._db.executemany('DELETE FROM artifact WHERE key = ?', keys)
+        self._db.commit()
+        log.debug('trimmed %s artifacts, %s bytes', len(keys), removed)
@@ -0,0 +1,182 @@
+import logging
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import session
+
+from app.db import get_db
+from app.metrics import metrics
+from app.models import AutocloseJob
+from app.models import Ticket as TicketModel
+
+log = logging.getLogger('autoclose')
+
+# ticket.autoclose values
+PENDING = 'pending'
+CLOSED = 'closed'
+SPAM = 'spam'
+FAILED = 'failed'
+
+# seconds between lookups of jobs due for a retry
+RESUME_INTERVAL = 60
+
+
+class Autocloser:
+    """Close/spam-mark actions off the polling thread, outcome saved on the row.
+
+    Every action is a job row, queued with the ticket and submitted only after
+    they are committed, the outcome is an update of the ticket. Failed actions
+    are retried with exponential backoff, then again every `retry_interval`.
+    Jobs left by a crash or restart are submitted again on the first resume.
+    """
+
+    def __init__(
+        self,
+        close: Callable[[int, bool], None],
+        system_name: str,
+        workers: int = 4,
+        retries: int = 3,
+        backoff: float = 2,
+        backoff_max: float = 60,
+        retry_interval: float = 600,
+    ):
+        self.close = close
+        self.system_name = system_name
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_interval = retry_interval
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='autoclose'
+        )
+        # masks submitted and not finished
+        self.running = set()
+        self.resumed_at = None
+
+    # job row in the session of the ticket, left to this worker for a while
+    def queue(
+        self, db_session: session, mask: str, ticket_id: int, mark_spam: bool
+    ) -> None:
+        db_session.merge(
+            AutocloseJob(
+                mask=mask,
+                system_name=self.system_name,
+                ticket_id=ticket_id,
+                mark_spam=mark_spam,
+                failures=0,
+                retry_at=datetime.now() + timedelta(seconds=self.retry_interval),
+            )
+        )
+
+    def submit(self, mask: str, ticket_id: int, mark_spam: bool) -> Future:
+        self.running.add(mask)
+        return self.executor.submit(self._run, mask, ticket_id, mark_spam)
+
+    #
+    # Submit jobs due for a retry, all of them on the first call
+    #
+    def resume(self) -> int:
+        now = monotonic()
+        if self.resumed_at is not None and now - self.resumed_at < RESUME_INTERVAL:
+            return 0
+        first = self.resumed_at is None
+        self.resumed_at = now
+
+        try:
+            with get_db() as db_session:
+                query = select(AutocloseJob).where(
+                    AutocloseJob.system_name == self.system_name
+                )
+                if not first:
+                    query = query.where(AutocloseJob.retry_at <= datetime.now())
+                # skip locked, sharded workers never pick the same job
+                jobs = [
+                    job
+                    for job in db_session.scalars(
+                        query.with_for_update(skip_locked=True)
+                    ).all()
+                    if job.mask not in self.running
+                ]
+                for job in jobs:
+                    job.retry_at = datetime.now() + timedelta(
+                        seconds=self.retry_interval
+                    )
+                jobs = [(job.mask, job.ticket_id, job.mark_spam) for job in jobs]
+        except Exception as e:
+            log.error('autoclose jobs not resumed: %s', e)
+            return 0
+
+        for mask, ticket_id, mark_spam in jobs:
+            log.info('autoclose mask:%s resumed', mask)
+            self.submit(mask, ticket_id, mark_spam)
+        return len(jobs)
+
+    def _run(self, mask: str, ticket_id: int, mark_spam: bool) -> str:
+        try:
+            return self._close(mask, ticket_id, mark_spam)
+        finally:
+            self.running.discard(mask)
+
+    def _close(self, mask: str, ticket_id: int, mark_spam: bool) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                self.close(ticket_id, mark_spam)
+                status = SPAM if mark_spam else CLOSED
+                break
+            except Exception as e:
+                log.warning(
+                    'autoclose mask:%s attempt %s failed: %s', mask, attempt + 1, e
+                )
+                status = FAILED
+                if attempt < self.retries:
+                    sleep(min(self.backoff * 2**attempt, self.backoff_max))
+
+        if status == FAILED:
+            log.error(
+                'autoclose mask:%s failed, left open, retry in %ss',
+                mask,
+                self.retry_interval,
+            )
+            metrics.inc(
+                'tickets_total', system=self.system_name, state='autoclose_failed'
+            )
+        else:
+            log.info('autoclosed ticket mask:%s with spam_mark:%s', mask, mark_spam)
+            metrics.inc('tickets_total', system=self.system_name, state='autoclosed')
+
+        try:
+            with get_db() as db_session:
+                db_session.execute(
+                    update(TicketModel)
+                    .where(TicketModel.mask == mask)
+                    .values(autoclose=status)
+                    .execution_options(synchronize_session=False)
+                )
+                if status == FAILED:
+                    db_session.execute(
+                        update(AutocloseJob)
+                        .where(AutocloseJob.mask == mask)
+                        .values(
+                            failures=AutocloseJob.failures + 1,
+                            retry_at=datetime.now()
+                            + timedelta(seconds=self.retry_interval),
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                else:
+                    db_session.execute(
+                        delete(AutocloseJob)
+                        .where(AutocloseJob.mask == mask)
+                        .execution_options(synchronize_session=False)
+                    )
+        except Exception as e:
+            log.error('autoclose mask:%s status not saved: %s', mask, e)
+
+        return status
+
+    # queued actions are finished unless cancelled
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
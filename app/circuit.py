@@ -0,0 +1,98 @@
+import logging
+import threading
+from time import monotonic
+
+from app.metrics import metrics
+
+log = logging.getLogger('circuit')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calls to a failing system/endpoint, probes it again later.
+
+    `failures` failures in a row open the circuit. After `reset_timeout`
+    seconds one call is let through as a probe, its success closes the
+    circuit, its failure opens it for another `reset_timeout`.
+
+    As a context manager: raises CircuitOpenError when not allowed, records
+    the outcome by whether the block raised.
+    """
+
+    def __init__(self, name: str, failures: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.failed = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if (
+                self.state == OPEN
+                and monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                # one probe, the rest wait for its outcome
+                self._set(HALF_OPEN)
+                return True
+            return False
+
+    # seconds until a call may be allowed again
+    def retry_in(self) -> float:
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            if self.state == HALF_OPEN:
+                return self.reset_timeout
+            return max(0, self.opened_at + self.reset_timeout - monotonic())
+
+    def success(self) -> None:
+        with self._lock:
+            self.failed = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failed += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failed >= self.failures
+            ):
+                self.opened_at = monotonic()
+                self._set(OPEN)
+
+    # under _lock
+    def _set(self, state: str) -> None:
+        log.log(
+            logging.WARNING if state == OPEN else logging.INFO,
+            'circuit %s %s -> %s',
+            self.name,
+            self.state,
+            state,
+        )
+        self.state = state
+        metrics.inc('circuit_transitions_total', breaker=self.name, state=state)
+
+    def __enter__(self):
+        if not self.allow():
+            raise CircuitOpenError(f'circuit {self.name} is open')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.success()
+        else:
+            self.failure()
+        return False
@@ -0,0 +1,380 @@
+import logging
+import math
+import os
+import signal
+import threading
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+
+from dotenv import dotenv_values
+
+log = logging.getLogger('config')
+
+# polled ticket systems, tokens from env
+TICKET_SYSTEMS = (
+    {
+        'kind': 'cerb',
+        'token_env': 'MJ_CERBERUS_TOKEN',
+        'buckets': (
+            600,  # Service
+            601,  # Support
+            # 1175, # Admin
+            # 1972, # Noc
+        ),
+    },
+    {
+        'kind': 'guru',
+        'token_env': 'MJ_GURU_TOKEN',
+        'query': 'статус:1,4 отдел:2,6 панель:mjd,md ',
+    },
+    {
+        'kind': 'guru',
+        'token_env': 'MC_GURU_TOKEN',
+        'query': 'статус:1,4 отдел:2,6 панель:mch,mc,myrw ',
+    },
+)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SystemConfig:
+    kind: str
+    token: str | None
+    buckets: tuple[int, ...] = ()
+    query: str = ''
+
+
+@dataclass(frozen=True)
+class PollConfig:
+    active: float
+    idle: float
+    offshift: float
+    backoff_max: float
+    jitter: float
+    workers: int
+    # seconds, a source still fetching past it counts as failed
+    source_timeout: float
+    # seconds, results not processed by then wait for the next cycle
+    cycle_timeout: float
+    # failures in a row that open a circuit, seconds before a probe
+    breaker_failures: int
+    breaker_reset: float
+
+
+@dataclass(frozen=True)
+class HttpConfig:
+    # connections kept alive per host, rspamd sets its own
+    pool_size: int
+    # seconds, default of every request
+    connect_timeout: float
+    read_timeout: float
+
+
+@dataclass(frozen=True)
+class TelegramConfig:
+    token: str | None
+    chat_id: str | None
+    rate_per_min: float
+    burst: int
+
+
+@dataclass(frozen=True)
+class CerbConfig:
+    page_parallel: int
+    max_pages: int
+    spam_score: bool
+    score_workers: int
+    score_timeout: float
+    # html parsing in worker processes, 0 in the calling thread
+    parse_workers: int
+    # 0 / 1 or auto, resolved by the caller before it is applied
+    autoclose: str
+    autoclose_min_score: float
+    autoclose_workers: int
+    autoclose_retries: int
+    # seconds before a failed close is tried again
+    autoclose_retry_interval: float
+    rspamd: bool
+    rspamd_url: str | None
+    smtp_relays: tuple[str, ...]
+    rspamd_connect_timeout: float
+    rspamd_timeout: float
+    rspamd_concurrency: int
+    rspamd_cache_size: int
+    rspamd_cache_ttl: float
+    artifact_cache_path: str | None
+    artifact_cache_memory_mb: int
+    artifact_cache_disk_mb: int
+
+
+@dataclass(frozen=True)
+class GuruConfig:
+    page_size: int
+    max_pages: int
+
+
+@dataclass(frozen=True)
+class Config:
+    """Typed settings, parsed and validated once per .env change.
+
+    Executors, caches and pools are sized at start, the rest applies on
+    reload.
+    """
+
+    ticket_systems: tuple[SystemConfig, ...]
+    poll: PollConfig
+    http: HttpConfig
+    telegram: TelegramConfig
+    cerb: CerbConfig
+    guru: GuruConfig
+    notify_max_score: float
+    retention_days: int
+    retention_interval: float
+    sharding: bool
+    shard_worker_id: str | None
+    shard_lease_ttl: float
+    metrics_port: int
+    metrics_host: str
+    log_level: str
+    log_file: str | None
+    log_max_mb: int
+    log_backups: int
+    log_format: str
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> 'Config':
+        parser = _Parser(env)
+        config = cls(
+            ticket_systems=tuple(
+                SystemConfig(
+                    kind=system['kind'],
+                    token=parser.get_str(system['token_env']),
+                    buckets=system.get('buckets', ()),
+                    query=system.get('query', ''),
+                )
+                for system in TICKET_SYSTEMS
+            ),
+            poll=PollConfig(
+                active=parser.get_float('POLL_INTERVAL_ACTIVE', 10, min_value=1),
+                # SLEEP_TIME, the old fixed interval
+                idle=parser.get_float(
+                    'POLL_INTERVAL_IDLE',
+                    parser.get_float('SLEEP_TIME', 25, min_value=1),
+                    min_value=1,
+                ),
+                offshift=parser.get_float('POLL_INTERVAL_OFFSHIFT', 120, min_value=1),
+                backoff_max=parser.get_float('POLL_BACKOFF_MAX', 600, min_value=1),
+                jitter=parser.get_float('POLL_JITTER', 0.1, min_value=0, max_value=0.5),
+                workers=parser.get_int('POLL_WORKERS', 8, min_value=1),
+                source_timeout=parser.get_float('POLL_SOURCE_TIMEOUT', 90, min_value=1),
+                cycle_timeout=parser.get_float('POLL_CYCLE_TIMEOUT', 120, min_value=1),
+                breaker_failures=parser.get_int('BREAKER_FAILURES', 5, min_value=1),
+                breaker_reset=parser.get_float('BREAKER_RESET', 60, min_value=1),
+            ),
+            http=HttpConfig(
+                pool_size=parser.get_int('HTTP_POOL_SIZE', 10, min_value=1),
+                connect_timeout=parser.get_float(
+                    'HTTP_CONNECT_TIMEOUT', 5, min_value=0.1
+                ),
+                read_timeout=parser.get_float('HTTP_READ_TIMEOUT', 30, min_value=0.1),
+            ),
+            telegram=TelegramConfig(
+                token=parser.get_str('TELEGRAM_TOKEN'),
+                chat_id=parser.get_str('TELEGRAM_CHAT_ID'),
+                rate_per_min=parser.get_float('TELEGRAM_RATE_PER_MIN', 20, min_value=1),
+                burst=parser.get_int('TELEGRAM_BURST', 5, min_value=1),
+            ),
+            cerb=CerbConfig(
+                page_parallel=parser.get_int('CERB_PAGE_PARALLEL', 4, min_value=1),
+                max_pages=parser.get_int('CERB_MAX_PAGES', 20, min_value=1),
+                spam_score=parser.get_bool('ENABLE_SPAM_SCORE'),
+                score_workers=parser.get_int('SCORE_WORKERS', 4, min_value=1),
+                score_timeout=parser.get_float('SCORE_TIMEOUT', 60, min_value=1),
+                parse_workers=parser.get_int('CERB_PARSE_WORKERS', 0),
+                autoclose=parser.get_choice(
+                    'ENABLE_AUTOCLOSE', ('0', '1', 'auto'), '0'
+                ),
+                autoclose_min_score=parser.get_float('AUTOCLOSE_MIN_SCORE', 10),
+                autoclose_workers=parser.get_int('AUTOCLOSE_WORKERS', 4, min_value=1),
+                autoclose_retries=parser.get_int('AUTOCLOSE_RETRIES', 3),
+                autoclose_retry_interval=parser.get_float(
+                    'AUTOCLOSE_RETRY_INTERVAL', 600, min_value=1
+                ),
+                rspamd=parser.get_bool('ENABLE_RSPAMD'),
+                rspamd_url=parser.get_str('RSPAMD_API_URL'),
+                smtp_relays=parser.get_list('CERB_SMTP_RELAY'),
+                rspamd_connect_timeout=parser.get_float(
+                    'RSPAMD_CONNECT_TIMEOUT', 3, min_value=0.1
+                ),
+                rspamd_timeout=parser.get_float('RSPAMD_TIMEOUT', 10, min_value=0.1),
+                rspamd_concurrency=parser.get_int('RSPAMD_CONCURRENCY', 4, min_value=1),
+                rspamd_cache_size=parser.get_int('RSPAMD_CACHE_SIZE', 1024),
+                rspamd_cache_ttl=parser.get_float(
+                    'RSPAMD_CACHE_TTL', 3600, min_value=0
+                ),
+                artifact_cache_path=parser.get_str(
+                    'ARTIFACT_CACHE_PATH', 'artifacts.sqlite'
+                ),
+                artifact_cache_memory_mb=parser.get_int('ARTIFACT_CACHE_MEMORY_MB', 32),
+                artifact_cache_disk_mb=parser.get_int('ARTIFACT_CACHE_DISK_MB', 512),
+            ),
+            guru=GuruConfig(
+                page_size=parser.get_int('GURU_PAGE_SIZE', 100, min_value=1),
+                max_pages=parser.get_int('GURU_MAX_PAGES', 20, min_value=1),
+            ),
+            notify_max_score=parser.get_float('NOTIFY_MAX_SCORE', 3),
+            retention_days=parser.get_int('RETENTION_DAYS', 0),
+            retention_interval=parser.get_float(
+                'RETENTION_INTERVAL', 3600, min_value=0
+            ),
+            sharding=parser.get_bool('SHARDING'),
+            shard_worker_id=parser.get_str('SHARD_WORKER_ID'),
+            shard_lease_ttl=parser.get_float('SHARD_LEASE_TTL', 60, min_value=1),
+            metrics_port=parser.get_int('METRICS_PORT', 0),
+            metrics_host=parser.get_str('METRICS_HOST') or '127.0.0.1',
+            log_level=parser.get_choice(
+                'LOG_LEVEL', ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'), 'DEBUG'
+            ),
+            log_file=parser.get_str('LOG_FILE', 'app.log'),
+            log_max_mb=parser.get_int('LOG_MAX_MB', 10, min_value=1),
+            log_backups=parser.get_int('LOG_BACKUPS', 5),
+            log_format=parser.get_choice('LOG_FORMAT', ('text', 'json'), 'text'),
+        )
+
+        if parser.errors:
+            raise ConfigError('; '.join(parser.errors))
+
+        return config
+
+
+class _Parser:
+    """Typed env values, every bad one collected instead of the first raised."""
+
+    def __init__(self, env: Mapping[str, str]):
+        self.env = env
+        self.errors = []
+
+    def _value(self, name: str) -> str | None:
+        # empty is unset, as the .env samples have it
+        value = self.env.get(name)
+        return value.strip() or None if value is not None else None
+
+    # default when unset, empty is None: a path set empty disables a file
+    def get_str(self, name: str, default: str | None = None) -> str | None:
+        value = self.env.get(name)
+        return default if value is None else value.strip() or None
+
+    def get_int(self, name: str, default: int, min_value: int = 0) -> int:
+        value = self._value(name)
+        if value is None:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            self.errors.append(f'{name}: not an integer: {value!r}')
+            return default
+        if number < min_value:
+            self.errors.append(f'{name}: less than {min_value}: {value!r}')
+            return default
+        return number
+
+    def get_float(
+        self,
+        name: str,
+        default: float,
+        min_value: float | None = None,
+        max_value: float | None = None,
+    ) -> float:
+        value = self._value(name)
+        if value is None:
+            return default
+        try:
+            number = float(value)
+        except ValueError:
+            number = math.nan
+        # nan/inf pass every bound check
+        if not math.isfinite(number):
+            self.errors.append(f'{name}: not a number: {value!r}')
+            return default
+        if min_value is not None and number < min_value:
+            self.errors.append(f'{name}: less than {min_value}: {value!r}')
+            return default
+        if max_value is not None and number > max_value:
+            self.errors.append(f'{name}: more than {max_value}: {value!r}')
+            return default
+        return number
+
+    def get_bool(self, name: str) -> bool:
+        return self.get_choice(name, ('0', '1'), '0') == '1'
+
+    def get_choice(self, name: str, choices: tuple[str, ...], default: str) -> str:
+        value = self._value(name)
+        if value is None:
+            return default
+        if value not in choices:
+            self.errors.append(f'{name}: not one of {choices}: {value!r}')
+            return default
+        return value
+
+    def get_list(self, name: str) -> tuple[str, ...]:
+        value = self._value(name) or ''
+        return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+#
+# Config of the process env + .env, reparsed on .env mtime change or SIGHUP
+#
+class ConfigWatcher:
+    def __init__(self, path: str = '.env'):
+        self.path = path
+        self.mtime = None
+        self.config = None
+        self._hup = threading.Event()
+        # called from get() after a SIGHUP, not from the signal handler
+        self._hup_callbacks = []
+
+    def install_sighup(self) -> None:
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda *_: self._hup.set())
+
+    def on_hup(self, callback: Callable[[], None]) -> None:
+        self._hup_callbacks.append(callback)
+
+    def _mtime(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    #
+    # Current config, a bad .env keeps the previous one
+    #
+    def get(self) -> Config:
+        mtime = self._mtime()
+        if self.config is not None and mtime == self.mtime and not self._hup.is_set():
+            return self.config
+
+        if self._hup.is_set():
+            self._hup.clear()
+            for callback in self._hup_callbacks:
+                callback()
+        self.mtime = mtime
+        # .env wins over the process env, as load_dotenv(override=True)
+        env = {**os.environ, **dotenv_values(self.path)}
+        try:
+            config = Config.from_env(
+                {name: value for name, value in env.items() if value is not None}
+            )
+        except ConfigError as e:
+            if self.config is None:
+                raise
+            log.error('config reload error, keep previous: %s', e)
+            return self.config
+
+        if self.config is not None:
+            log.info('config reloaded from %s', self.path)
+        self.config = config
+        return config
@@ -0,0 +1,48 @@
+import logging
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger('cpu_pool')
+
+
+class CpuPool:
+    """CPU bound calls in worker processes, away from the GIL of the poller.
+
+    Inline when `workers` is 0. Functions must be module level, arguments
+    and results are pickled, so pass raw payloads and get compact records.
+    """
+
+    def __init__(self, workers: int = 0):
+        self.workers = workers
+        self.executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor | None:
+        if self.workers <= 0:
+            return None
+        # spawn, forked children would inherit locks of the running threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+
+    #
+    # Call in a worker, blocks the calling thread only
+    #
+    def run(self, fn: Callable, *args):
+        executor = self.executor
+        if executor is None:
+            return fn(*args)
+
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # worker killed (oom), new pool for the next calls
+            log.error('process pool broken, restart it')
+            if self.executor is executor:
+                self.executor = self._new_executor()
+            return fn(*args)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,10 +1,15 @@
 import os
 from contextlib import contextmanager
+from time import perf_counter
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from app.metrics import metrics
+
 Base = declarative_base()
 
 engine = create_engine(
@@ -16,14 +21,56 @@ engine = create_engine(
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
 
+# flush timing, explicit and the one inside commit
+@event.listens_for(SessionLocal, 'before_flush')
+def _flush_started(Session, _flush_context, _instances):
+    Session.info['flush_started'] = perf_counter()
+
+
+@event.listens_for(SessionLocal, 'after_flush_postexec')
+def _flush_finished(Session, _flush_context):
+    started = Session.info.pop('flush_started', None)
+    if started is not None:
+        metrics.observe(
+            'stage_seconds', perf_counter() - started, stage='db', target='flush'
+        )
+
+
 @contextmanager
 def get_db():
     Session = SessionLocal()
     try:
         yield Session
-        Session.commit()
+        with metrics.timer('stage_seconds', stage='db', target='commit'):
+            Session.commit()
     except Exception:
         Session.rollback()
         raise
     finally:
         Session.close()
+
+
+#
+# Insert rows, skip the ones already there, rows of a chunk are one statement
+#
+def insert_ignore(db_session, model, rows: list[dict]) -> None:
+    if not rows:
+        return
+
+    dialect = db_session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(model).prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(model).on_conflict_do_nothing()
+    elif dialect == 'postgresql':
+        stmt = postgresql.insert(model).on_conflict_do_nothing()
+    else:
+        for row in rows:
+            try:
+                with db_session.begin_nested():
+                    db_session.execute(insert(model), row)
+            except IntegrityError:
+                pass
+        return
+
+    db_session.execute(stmt, rows)
@@ -0,0 +1,82 @@
+import logging
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from importlib.util import find_spec
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import HttpConfig
+
+log = logging.getLogger('http_client')
+
+# urllib3 decodes br only when brotli/brotlicffi is installed
+if find_spec('brotli') or find_spec('brotlicffi'):
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+else:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+# defaults of app.config until configure()
+_config = HttpConfig(pool_size=10, connect_timeout=5, read_timeout=30)
+
+
+#
+# Settings of new sessions, timeouts apply to every next request
+#
+def configure(config: HttpConfig) -> None:
+    global _config
+    _config = config
+
+
+#
+# Get pooled session per host
+#
+def get_session(url: str, pool_size: int | None = None) -> requests.Session:
+    parts = urlsplit(url)
+    host = f'{parts.scheme}://{parts.netloc}'
+
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = _new_session(pool_size or _config.pool_size)
+            log.debug('new http session for %s', host)
+
+        return _sessions[host]
+
+
+#
+# Close all sessions
+#
+def close_sessions() -> None:
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    # default (connect, read) timeout, a hung server never blocks forever
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (_config.connect_timeout, _config.read_timeout)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def _new_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+
+    # one host per session, keep up to pool_size connections alive
+    adapter = _TimeoutAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    session.headers['Connection'] = 'keep-alive'
+
+    # sessions are shared between instances with different tokens,
+    # auth is sent explicitly in headers, dont keep server cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    return session
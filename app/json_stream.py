@@ -0,0 +1,98 @@
+import codecs
+import json
+import re
+from collections.abc import Iterable, Iterator
+
+_WS_RE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+# may continue a number, never follow a complete value
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+# consumed text dropped from the buffer past this size
+TRIM_SIZE = 64 * 1024
+
+
+class _Buffer:
+    """Text decoded from byte chunks on demand, read left to right."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+
+    def more(self) -> bool:
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                if self.pos > TRIM_SIZE:
+                    self.text = self.text[self.pos :]
+                    self.pos = 0
+                self.text += text
+                return True
+        return False
+
+    def char(self) -> str:
+        # next non whitespace char, not consumed
+        while True:
+            self.pos = _WS_RE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                raise ValueError('unexpected end of json')
+
+    def expect(self, char: str) -> None:
+        if self.char() != char:
+            raise ValueError(
+                f'expected {char!r} at {self.pos}: {self.text[self.pos]!r}'
+            )
+        self.pos += 1
+
+    def value(self):
+        self.char()
+        while True:
+            # a complete value inside an object is always followed by something,
+            # a number touching the end or a number char may be cut
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                if end < len(self.text) and self.text[end] not in _NUMBER_CHARS:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            if not self.more():
+                raise ValueError('unexpected end of json')
+
+
+#
+# Items of one array member of a top level object, decoded one by one
+#
+def iter_json_list(chunks: Iterable[bytes], key: str) -> Iterator:
+    """Yields `obj[key]` items from JSON object bytes, KeyError if not found.
+
+    Members before `key` are decoded and dropped, nothing after it is read.
+    """
+    buffer = _Buffer(chunks)
+    buffer.expect('{')
+
+    if buffer.char() == '}':
+        raise KeyError(key)
+
+    while True:
+        name = buffer.value()
+        buffer.expect(':')
+
+        if name == key:
+            buffer.expect('[')
+            if buffer.char() == ']':
+                return
+            while True:
+                yield buffer.value()
+                if buffer.char() == ']':
+                    return
+                buffer.expect(',')
+
+        buffer.value()
+        if buffer.char() == '}':
+            raise KeyError(key)
+        buffer.expect(',')
@@ -0,0 +1,70 @@
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '[%(asctime)s][%(name)s][%(levelname)s][%(message)s]'
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact json object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # record is formatted by the listener thread, not by the caller
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+#
+# Root logger through a queue, handlers run on a listener thread
+#
+def setup_logging(
+    level: str = 'DEBUG',
+    console_level: str = 'INFO',
+    file_path: str | None = 'app.log',
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    json_format: bool = False,
+) -> QueueListener:
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+
+    # stdout handler
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(console_level)
+    handler.setFormatter(formatter)
+    handlers.append(handler)
+
+    # file handler, rotated by size
+    if file_path:
+        file_handler = RotatingFileHandler(
+            file_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    log = logging.getLogger()
+    log.setLevel(level)
+    for old_handler in list(log.handlers):
+        log.removeHandler(old_handler)
+    log.addHandler(_DeferredQueueHandler(log_queue))
+
+    return listener
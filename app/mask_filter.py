@@ -0,0 +1,93 @@
+import logging
+import math
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import session
+from xxhash import xxh3_128_intdigest
+
+from app.models import Ticket as TicketModel
+
+log = logging.getLogger('mask_filter')
+
+# ids below the last seen max re-read, inserts of other workers commit late
+SYNC_OVERLAP = 100
+
+
+class BloomFilter:
+    """Fixed size set of strings, no false negatives."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # k positions from one 128 bit hash, double hashing
+        digest = xxh3_128_intdigest(item.encode())
+        h1, h2 = digest >> 64, digest & 0xFFFFFFFFFFFFFFFF | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item)
+        )
+
+
+class MaskFilter:
+    """Masks of the tickets table, a miss means the mask is definitely new.
+
+    Synced by id from the db, full reload when over capacity or after reset.
+    Archived masks stay in until the next reload, a false positive only
+    costs the usual lookup.
+    """
+
+    def __init__(self, error_rate: float = 0.01, min_capacity: int = 10_000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.bloom = None
+        self.max_id = 0
+        self.count = 0
+
+    def reset(self) -> None:
+        self.bloom = None
+        self.max_id = 0
+        self.count = 0
+
+    #
+    # Load masks inserted since the last sync
+    #
+    def sync(self, db_session: session) -> None:
+        if self.bloom is None:
+            total = db_session.scalar(select(func.count(TicketModel.id))) or 0
+            self.bloom = BloomFilter(max(total * 2, self.min_capacity), self.error_rate)
+            self.max_id = 0
+            self.count = 0
+            log.info('mask filter reload, %s tickets', total)
+
+        rows = db_session.execute(
+            select(TicketModel.id, TicketModel.mask).where(
+                TicketModel.id > self.max_id - SYNC_OVERLAP
+            )
+        ).tuples()
+        last_id = self.max_id
+        for ticket_id, mask in rows:
+            self.bloom.add(mask)
+            if ticket_id > last_id:
+                self.count += 1
+            self.max_id = max(self.max_id, ticket_id)
+
+        if self.count > self.bloom.capacity:
+            self.bloom = None
+            self.sync(db_session)
+
+    def maybe_known(self, mask: str) -> bool:
+        return self.bloom is None or mask in self.bloom
+
+
+mask_filter = MaskFilter()
@@ -0,0 +1,142 @@
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+log = logging.getLogger('metrics')
+
+PREFIX = 'ticketsync_'
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# fetch intervals of slow and backed off sources
+BUCKETS += (300, 600)
+
+HELP = {
+    'stage_seconds': 'Duration of a polling stage',
+    'cycle_seconds': 'Duration of a main loop cycle, fetches run in the background',
+    'fetch_seconds': 'Duration of a source fetch, submit to done',
+    'fetch_interval_seconds': 'Time between successful fetches of a source',
+    'tickets_total': 'Tickets by processing state',
+    'rspamd_cache_total': 'rspamd results by cache hit/miss',
+    'circuit_transitions_total': 'Circuit breaker state changes',
+}
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: str = '') -> str:
+    parts = [
+        '{}="{}"'.format(
+            key,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+        )
+        for key, value in labels
+    ]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+#
+# Counters and histograms, Prometheus text format
+#
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {name: {labels: value}}
+        self.counters = {}
+        # {name: {labels: [bucket counts, sum, count]}}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = [[0] * len(BUCKETS), 0.0, 0]
+            buckets, _, _ = series[key]
+            index = bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                buckets[index] += 1
+            series[key][1] += seconds
+            series[key][2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = []
+
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# HELP {PREFIX}{name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{PREFIX}{name}{_format_labels(labels)} {value}')
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# HELP {PREFIX}{name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for labels, (buckets, total, count) in sorted(series.items()):
+                    cumulative = 0
+                    for le, bucket in zip(BUCKETS, buckets, strict=True):
+                        cumulative += bucket
+                        bucket_labels = _format_labels(labels, f'le="{le}"')
+                        lines.append(
+                            f'{PREFIX}{name}_bucket{bucket_labels} {cumulative}'
+                        )
+                    bucket_labels = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {count}')
+                    lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {total}')
+                    lines.append(
+                        f'{PREFIX}{name}_count{_format_labels(labels)} {count}'
+                    )
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+#
+# /metrics endpoint
+#
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            data = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    log.info('metrics on http://%s:%s/metrics', host, port)
+
+    return server
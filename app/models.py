@@ -1,23 +1,14 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, Float, String
+from sqlalchemy import Boolean, DateTime, Float, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db import Base
 
 
-class Ticket(Base):
-    __tablename__ = 'tickets'
-    # temp vars
-    local_id = int
-
+class TicketColumns:
     id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
     system_name: Mapped[str] = mapped_column(String(16), nullable=False)
-    # TODO
-    # string > 16: HG-65931-157-MERGED
-    mask: Mapped[str] = mapped_column(
-        String(16), unique=True, index=True, nullable=False
-    )
     group: Mapped[str] = mapped_column(String(16), nullable=False)
     # sub_group: Mapped[str] = mapped_column(String(16), nullable=False)
     subject: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -28,6 +19,30 @@ class Ticket(Base):
     )
     updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     spam_score: Mapped[float] = mapped_column(Float, default=0)
+    # app.autoclose outcome: pending/closed/spam/failed, None if not closed
+    autoclose: Mapped[str | None] = mapped_column(String(16), nullable=True)
+
+
+class Ticket(TicketColumns, Base):
+    __tablename__ = 'tickets'
+    # temp vars
+    local_id = int
+
+    # merged masks: HG-65931-157-MERGED
+    mask: Mapped[str] = mapped_column(
+        String(64), unique=True, index=True, nullable=False
+    )
+
+
+# tickets not updated for RETENTION_DAYS, moved by app.retention
+class TicketArchive(TicketColumns, Base):
+    __tablename__ = 'tickets_archive'
+
+    # own ids, same mask again if the ticket came back and was archived twice
+    mask: Mapped[str] = mapped_column(String(64), index=True, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, nullable=False
+    )
 
 
 class SpamscoreList(Base):
@@ -40,3 +55,38 @@ class SpamscoreList(Base):
     body: Mapped[str] = mapped_column(String(255), nullable=True)
     body_hash: Mapped[str] = mapped_column(String(32), nullable=True)
     comment: Mapped[str] = mapped_column(String(255), nullable=True)
+
+
+class SourceLease(Base):
+    __tablename__ = 'ticket_source_leases'
+
+    # poller source, or worker:<id> heartbeat
+    source: Mapped[str] = mapped_column(String(128), primary_key=True)
+    owner: Mapped[str] = mapped_column(String(64), nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class TicketClaim(Base):
+    __tablename__ = 'ticket_claims'
+
+    # one notify/close per ticket change, by the worker that claimed it
+    mask: Mapped[str] = mapped_column(String(64), primary_key=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    owner: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, nullable=False, index=True
+    )
+
+
+class AutocloseJob(Base):
+    __tablename__ = 'ticket_autoclose_jobs'
+
+    # close/spam-mark not done yet, deleted once it succeeds
+    mask: Mapped[str] = mapped_column(String(64), primary_key=True)
+    system_name: Mapped[str] = mapped_column(String(16), nullable=False)
+    ticket_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    mark_spam: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # failed runs, each with its own retries
+    failures: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # picked up again from then, moved ahead while a worker runs it
+    retry_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
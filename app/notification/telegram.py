@@ -1,26 +1,190 @@
-import requests
+import logging
+import threading
+from collections import deque
+from time import monotonic, sleep
 
+from app.config import TelegramConfig
+from app.http_client import get_session
+from app.metrics import metrics
 from app.models import Ticket as TicketModel
 from app.notification.base import BaseClass
 
+log = logging.getLogger('notification.telegram')
+
 
 class Telegram(BaseClass):
+    API_URL = 'https://api.telegram.org'
+    # sendMessage text limit
+    MAX_TEXT_LENGTH = 4096
     BOT_TOKEN = str
     CHAT_ID = str
 
-    def __init__(self, token: str, chat_id: int):
-        self.BOT_TOKEN = token
-        self.CHAT_ID = chat_id
+    def __init__(self, config: TelegramConfig, max_retries: int = 5):
+        self.cond = threading.Condition()
+        self.configure(config)
+
+        # token bucket, per chat limits
+        self.tokens = float(self.burst)
+        self.refilled_at = monotonic()
+        # retry_after / retry backoff
+        self.blocked_until = 0
+        self.max_retries = max_retries
+
+        # [{'header': str, 'lines': [str], 'attempts': int}]
+        self.queue = deque()
+        self.stopping = False
+        self.worker = threading.Thread(target=self._run, name='telegram', daemon=True)
+        self.worker.start()
+
+    # reloaded token/chat/limits, read by the sender thread
+    def configure(self, config: TelegramConfig) -> None:
+        if config.rate_per_min <= 0:
+            raise ValueError(f'rate_per_min must be > 0: {config.rate_per_min}')
+        with self.cond:
+            self.BOT_TOKEN = config.token
+            self.CHAT_ID = config.chat_id
+            self.rate = config.rate_per_min / 60
+            self.burst = config.burst
+            self.cond.notify()
 
+    #
+    # Queue ticket notification, never blocks on I/O
+    #
     def notify(self, ticket: TicketModel) -> None:
+        # ticket is read here, it may be detached when sent
+        item = {
+            'header': f'{ticket.system_name}/{ticket.group}',
+            'lines': [f'<a href="{ticket.url}">{ticket.subject}</a>'],
+            'attempts': 0,
+        }
+
+        with self.cond:
+            self.queue.append(item)
+            self.cond.notify()
+
+    #
+    # Send queued messages and stop
+    #
+    def close(self, timeout: float = 10) -> None:
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.worker.join(timeout)
+
+    #
+    # Sender thread
+    #
+    def _run(self) -> None:
+        while True:
+            try:
+                with self.cond:
+                    while not self.queue and not self.stopping:
+                        self.cond.wait()
+                    if not self.queue:
+                        return
+
+                    now = monotonic()
+                    self._refill(now)
+
+                    # wait retry_after / send budget
+                    wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                    if wait > 0:
+                        self.cond.wait(wait)
+                        continue
+
+                    # burst over budget, one message per system/group
+                    if len(self.queue) > self.tokens:
+                        self._coalesce()
+
+                    item = self.queue.popleft()
+                    self.tokens -= 1
+
+                self._send(item)
+            except Exception:
+                # the thread must outlive a bug, queued messages are kept
+                log.exception('sender error')
+                sleep(1)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.refilled_at) * self.rate
+        )
+        self.refilled_at = now
+
+    def _coalesce(self) -> None:
+        merged = {}
+        for item in self.queue:
+            if item['header'] not in merged:
+                merged[item['header']] = {
+                    'header': item['header'],
+                    'lines': [],
+                    'attempts': 0,
+                }
+            merged[item['header']]['lines'].extend(item['lines'])
+
+        self.queue.clear()
+        for item in merged.values():
+            self.queue.extend(self._split(item))
+
+        log.debug('coalesced queue to %s messages', len(self.queue))
+
+    # split merged item by text limit
+    def _split(self, item: dict) -> list[dict]:
+        chunks = []
+        lines = []
+        length = len(item['header'])
+
+        for line in item['lines']:
+            if lines and length + 1 + len(line) > self.MAX_TEXT_LENGTH:
+                chunks.append({**item, 'lines': lines})
+                lines = []
+                length = len(item['header'])
+            lines.append(line)
+            length += 1 + len(line)
+
+        chunks.append({**item, 'lines': lines})
+        return chunks
+
+    def _send(self, item: dict) -> None:
         data = {
             'chat_id': self.CHAT_ID,
-            'text': f'{ticket.system_name}/{ticket.group}\n<a href="{ticket.url}">{ticket.subject}</a>',
+            'text': '\n'.join([item['header'], *item['lines']]),
             'parse_mode': 'HTML',
             #'disable_notification': 'true',
             #'silent': 'true'
         }
 
-        requests.post(
-            f'https://api.telegram.org/bot{self.BOT_TOKEN}/sendMessage', data=data
-        )
+        retry_after = None
+        try:
+            with metrics.timer('stage_seconds', stage='notify', target='telegram'):
+                resp = get_session(self.API_URL).post(
+                    f'{self.API_URL}/bot{self.BOT_TOKEN}/sendMessage', data=data
+                )
+            if resp.status_code == 200:
+                return
+
+            if resp.status_code == 429:
+                retry_after = resp.json().get('parameters', {}).get('retry_after', 1)
+                log.warning('too many requests, retry after %ss', retry_after)
+            elif resp.status_code < 500:
+                # bad request, wont pass on retry
+                log.error('send error %s: %s, drop', resp.status_code, resp.text)
+                return
+            else:
+                log.error('send error %s', resp.status_code)
+        except Exception as e:
+            log.error('send error: %s', e)
+
+        with self.cond:
+            if retry_after is not None:
+                # rate limit is not a failure of the message
+                self.tokens = 0
+                self.blocked_until = monotonic() + retry_after
+            else:
+                item['attempts'] += 1
+                if item['attempts'] > self.max_retries:
+                    log.error('%s: retries exceeded, drop', item['header'])
+                    return
+                self.blocked_until = monotonic() + 2 ** item['attempts']
+
+            self.queue.appendleft(item)
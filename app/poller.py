@@ -0,0 +1,256 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from time import monotonic, sleep
+
+from sqlalchemy.orm import session
+
+from app.metrics import metrics
+from app.models import Ticket as TicketModel
+from app.scheduler import Scheduler
+from app.sharding import Shard
+from app.ticket_batch import TicketBatch
+from app.tsystem.base import BaseClass as TicketSystem
+
+log = logging.getLogger('poller')
+
+# seconds, a system whose processing failed waits this long for a retry
+# of its finished background work
+PROCESS_RETRY_DELAY = 10
+
+
+class Poller:
+    TICKET_SYSTEMS = list[TicketSystem]
+
+    def __init__(
+        self,
+        ticket_systems: list[TicketSystem],
+        scheduler: Scheduler,
+        max_workers: int = 8,
+        shard: Shard | None = None,
+        source_timeout: float = 90,
+        cycle_timeout: float = 120,
+    ):
+        self.TICKET_SYSTEMS = ticket_systems
+        self.scheduler = scheduler
+        # seconds, see PollConfig
+        self.source_timeout = source_timeout
+        self.cycle_timeout = cycle_timeout
+        # sharded worker, sources and ticket changes split by leases/claims
+        self.shard = shard
+        for ticket_system in ticket_systems:
+            ticket_system.shard = shard
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='poller'
+        )
+        # {source: (system index, job key, future, started at)}, kept across cycles
+        self.inflight = {}
+        # sources past source_timeout, their late results are dropped
+        self.overdue = set()
+        # {system index: monotonic time} failed processing, retried after it
+        self.retry_at = {}
+        # {source: monotonic time} of the last successful fetch
+        self.fetched_at = {}
+
+    #
+    # Poll due sources, process the finished ones
+    #
+    def poll(self, db_session: session) -> list[TicketModel]:
+        now = monotonic()
+        deadline = now + self.cycle_timeout
+
+        jobs = {
+            f'{index}:{ticket_system.SYSTEM_NAME}:{key}': (index, key, job)
+            for index, ticket_system in enumerate(self.TICKET_SYSTEMS)
+            for key, job in ticket_system.fetch_jobs().items()
+        }
+        # sources leased by this worker, all when not sharded
+        owned = set(jobs) if self.shard is None else self.shard.renew(list(jobs))
+
+        # start every due source at once, a slow one never delays the others
+        for source, (index, key, job) in jobs.items():
+            if source not in owned or source in self.inflight:
+                continue
+            if not self.scheduler.is_due(source, now):
+                continue
+            # open circuit, the system is left alone until a probe
+            breaker = self.TICKET_SYSTEMS[index].breaker
+            if not breaker.allow():
+                self.scheduler.defer(source, breaker.retry_in(), now)
+                continue
+            self.scheduler.start(source, now)
+            future = self.executor.submit(job)
+            future.add_done_callback(
+                partial(
+                    self._fetch_done,
+                    self.TICKET_SYSTEMS[index].SYSTEM_NAME,
+                    key,
+                    monotonic(),
+                )
+            )
+            self.inflight[source] = (index, key, future, now)
+
+        # collect finished sources
+        results = {}
+        for source, (index, key, future, started_at) in list(self.inflight.items()):
+            breaker = self.TICKET_SYSTEMS[index].breaker
+
+            if not future.done():
+                # hung fetch, failed now, the thread ends on the http timeout
+                if (
+                    now - started_at > self.source_timeout
+                    and source not in self.overdue
+                ):
+                    log.error('fetch %s timed out', source)
+                    self.overdue.add(source)
+                    breaker.failure()
+                continue
+            del self.inflight[source]
+
+            if source in self.overdue:
+                self.overdue.discard(source)
+                log.info('late fetch %s finished, drop result', source)
+                self.scheduler.report(source, error=True)
+                continue
+
+            try:
+                result = future.result()
+            except Exception as e:
+                log.error('fetch %s error: %s', source, e)
+                self.scheduler.report(source, error=True)
+                breaker.failure()
+                continue
+            breaker.success()
+
+            # lease lost while fetching, the new owner reads it
+            if source not in owned:
+                log.info('lost lease of %s, drop result', source)
+                continue
+
+            # a growing interval is a slow or skipped source
+            if source in self.fetched_at:
+                metrics.observe(
+                    'fetch_interval_seconds',
+                    now - self.fetched_at[source],
+                    system=self.TICKET_SYSTEMS[index].SYSTEM_NAME,
+                    source=key,
+                )
+            self.fetched_at[source] = now
+
+            active = result is not None and bool(
+                self.TICKET_SYSTEMS[index].changed_rows(key, result['rows'])
+            )
+            self.scheduler.report(source, active=active)
+            results.setdefault(index, {})[key] = result
+
+        # a past deadline of a source not polled here would spin wait()
+        self.scheduler.retain(owned | self.inflight.keys())
+        for source in self.fetched_at.keys() - owned:
+            del self.fetched_at[source]
+
+        # finished background work is picked up without a fetch
+        for index in range(len(self.TICKET_SYSTEMS)):
+            if any(future.done() for future in self._pending_work(index, now)):
+                results.setdefault(index, {})
+
+        # merge results in one db session, sequentially, one write for all
+        tickets = []
+        batch = TicketBatch()
+        for index, system_results in sorted(results.items()):
+            ticket_system = self.TICKET_SYSTEMS[index]
+            # nothing staged, changed rows are read again next cycle
+            if monotonic() >= deadline:
+                log.warning(
+                    'cycle deadline, %s results wait for next cycle',
+                    ticket_system.SYSTEM_NAME,
+                )
+                continue
+
+            log.debug('fetched %s: %s', ticket_system.SYSTEM_NAME, list(system_results))
+            # a failing system drops only its own changes
+            system_batch = TicketBatch()
+            try:
+                system_tickets = ticket_system.process_tickets(
+                    db_session, system_results, system_batch
+                )
+            except Exception as e:
+                log.error('process %s error: %s', ticket_system.SYSTEM_NAME, e)
+                ticket_system.rollback_hashes()
+                self.retry_at[index] = monotonic() + PROCESS_RETRY_DELAY
+                continue
+            self.retry_at.pop(index, None)
+
+            batch.merge(system_batch)
+            tickets.extend(system_tickets)
+        batch.write(db_session)
+
+        return tickets
+
+    #
+    # Sleep until next due source or first finished fetch
+    #
+    def wait(self) -> None:
+        now = monotonic()
+        timeout = max(0, self.scheduler.next_deadline() - now)
+        if self.shard is not None:
+            # leases are renewed on poll
+            timeout = min(timeout, self.shard.renew_interval)
+        futures = self.pending_work()
+        for retry_at in self.retry_at.values():
+            # wake up to retry a failed system
+            timeout = min(timeout, max(0, retry_at - now))
+        for source, (_, _, future, started_at) in self.inflight.items():
+            futures.append(future)
+            # wake up to fail a hung source
+            if source not in self.overdue:
+                timeout = min(timeout, max(0, started_at + self.source_timeout - now))
+
+        if futures:
+            wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            sleep(timeout)
+
+    # in the worker thread, late and failed fetches too
+    def _fetch_done(
+        self, system_name: str, key: str, started_at: float, future: Future
+    ) -> None:
+        metrics.observe(
+            'fetch_seconds',
+            monotonic() - started_at,
+            system=system_name,
+            source=key,
+            result='error' if future.cancelled() or future.exception() else 'ok',
+        )
+
+    # background work of the ticket systems, a finished one is processed on poll
+    def pending_work(self) -> list[Future]:
+        now = monotonic()
+        return [
+            future
+            for index in range(len(self.TICKET_SYSTEMS))
+            for future in self._pending_work(index, now)
+        ]
+
+    # none while the system waits for a retry of failed processing
+    def _pending_work(self, index: int, now: float) -> list[Future]:
+        if self.retry_at.get(index, 0) > now:
+            return []
+        return self.TICKET_SYSTEMS[index].pending_work()
+
+    #
+    # Keep/drop change detection state of the cycle, after db commit/rollback
+    #
+    def commit_changes(self) -> None:
+        for ticket_system in self.TICKET_SYSTEMS:
+            ticket_system.commit_hashes()
+
+    def rollback_changes(self) -> None:
+        for ticket_system in self.TICKET_SYSTEMS:
+            ticket_system.rollback_hashes()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for ticket_system in self.TICKET_SYSTEMS:
+            ticket_system.close()
+        if self.shard is not None:
+            self.shard.release()
@@ -0,0 +1,100 @@
+import logging
+from datetime import datetime, timedelta
+from time import monotonic
+
+from sqlalchemy import delete, literal, select
+
+from app.db import get_db
+from app.mask_filter import mask_filter
+from app.models import Ticket as TicketModel
+from app.models import TicketArchive
+
+log = logging.getLogger('retention')
+
+# rows moved per transaction, keeps locks short
+ARCHIVE_CHUNK_SIZE = 1000
+# copied to the archive, id is its own
+COLUMNS = (
+    'system_name',
+    'mask',
+    'group',
+    'subject',
+    'url',
+    'user',
+    'created_at',
+    'updated_at',
+    'spam_score',
+    'autoclose',
+)
+
+
+class Retention:
+    """Tickets not updated for `days` moved from tickets to tickets_archive.
+
+    The hot table stays small for lookups and the mask index. Rows are
+    locked with skip locked, sharded workers never move the same chunk.
+    """
+
+    def __init__(self, days: int, interval: float = 3600):
+        self.days = days
+        self.interval = interval
+        self.ran_at = None
+
+    #
+    # Archive idle tickets, at most once per interval
+    #
+    def run(self) -> int:
+        now = monotonic()
+        if self.days <= 0:
+            return 0
+        if self.ran_at is not None and now - self.ran_at < self.interval:
+            return 0
+        self.ran_at = now
+
+        cutoff = datetime.now() - timedelta(days=self.days)
+        moved = 0
+        try:
+            while True:
+                with get_db() as db_session:
+                    count = self._archive_chunk(db_session, cutoff)
+                moved += count
+                if count < ARCHIVE_CHUNK_SIZE:
+                    break
+        except Exception as e:
+            log.error('archive error: %s', e)
+
+        if moved:
+            # archived masks out of the filter
+            mask_filter.reset()
+            log.info('archived %s tickets not updated since %s', moved, cutoff)
+
+        return moved
+
+    def _archive_chunk(self, db_session, cutoff: datetime) -> int:
+        ids = db_session.scalars(
+            select(TicketModel.id)
+            .where(TicketModel.updated_at < cutoff)
+            .order_by(TicketModel.id)
+            .limit(ARCHIVE_CHUNK_SIZE)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not ids:
+            return 0
+
+        archived_at = datetime.now()
+        db_session.execute(
+            TicketArchive.__table__.insert().from_select(
+                [*COLUMNS, 'archived_at'],
+                select(
+                    *(getattr(TicketModel, column) for column in COLUMNS),
+                    literal(archived_at).label('archived_at'),
+                ).where(TicketModel.id.in_(ids)),
+            )
+        )
+        db_session.execute(
+            delete(TicketModel)
+            .where(TicketModel.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+
+        return len(ids)
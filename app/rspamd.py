@@ -0,0 +1,201 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from email.utils import parseaddr
+from functools import lru_cache
+from time import monotonic
+
+from xxhash import xxh128_hexdigest
+
+from app.circuit import CircuitBreaker
+from app.http_client import get_session
+from app.metrics import metrics
+
+log = logging.getLogger('rspamd')
+
+# folded header continuation
+_FOLD_RE = re.compile(r'\r?\n[ \t]+')
+# Received: from helo (rdns [ip]) by ..., the from part
+_RECEIVED_RE = re.compile(
+    r'Received:\s*from\s+(\S+)(?:(?!\sby\s)[^\[\n])*(?:\[([0-9A-Fa-f.:]+)\])?',
+    flags=re.IGNORECASE,
+)
+_SENDERS = frozenset(('from', 'return-path', 'sender'))
+
+
+#
+# Matcher of local relay names, compiled once per relay list
+#
+@lru_cache(maxsize=8)
+def relay_matcher(relays: tuple[str, ...]) -> re.Pattern | None:
+    if not relays:
+        return None
+    return re.compile('|'.join(re.escape(relay) for relay in relays))
+
+
+#
+# Header block split into fields in one pass, local Received: dropped
+#
+def split_headers(headers: str, local_relay: re.Pattern | None = None) -> list[str]:
+    """Raw fields with their continuation lines, joined they give the block back.
+
+    A Received: field whose first line matches `local_relay` is left out,
+    rspamd checks spf against the external sender then.
+    """
+    fields = []
+    drop = False
+    for line in headers.splitlines(keepends=True):
+        # continuation of the field above, dropped along with it
+        if line[:1] in (' ', '\t') and (fields or drop):
+            if not drop:
+                fields[-1].append(line)
+            continue
+
+        drop = (
+            local_relay is not None
+            and line[:9].lower() == 'received:'
+            and local_relay.search(line) is not None
+        )
+        if not drop:
+            fields.append([line])
+
+    return [''.join(field) for field in fields]
+
+
+#
+# Cache key, same body from the same sender through the same relays
+#
+def cache_key(body_hash: str, fields: list[str]) -> str:
+    # ids and dates differ per message, keep who sent it and where from
+    senders = []
+    relays = []
+    for field in fields:
+        name, _, value = field.partition(':')
+        name = name.lower()
+        if name in _SENDERS:
+            value = _FOLD_RE.sub(' ', value).strip()
+            senders.append(f'{name}={parseaddr(value)[1].lower()}')
+        elif name == 'received':
+            match = _RECEIVED_RE.match(_FOLD_RE.sub(' ', field))
+            if match:
+                helo, ip = match.groups()
+                relays.append(f'{helo.lower()}[{ip or ""}]')
+
+    return xxh128_hexdigest('\x1f'.join([body_hash, *sorted(senders), *relays]))
+
+
+class _Body:
+    """Request body of byte chunks, with a length so no chunked encoding."""
+
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+        self.length = sum(len(chunk) for chunk in chunks)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class RspamdClient:
+    """checkv2 client, results cached by `cache_key` for `cache_ttl` seconds.
+
+    The message is given as parts (header fields, body), encoded only on a
+    cache miss.
+
+    At most `max_concurrent` scans run at once, a scan already running for
+    the same key is waited for instead of sent again.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 3,
+        read_timeout: float = 10,
+        max_concurrent: int = 4,
+        cache_size: int = 1024,
+        cache_ttl: float = 3600,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        # rspamd down, tickets are scored without it instead of waiting
+        self.breaker = breaker or CircuitBreaker('rspamd')
+        self.max_concurrent = max_concurrent
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        # {key: (expires_at, result)}, least recently used first
+        self._cache = OrderedDict()
+        # {key: threading.Event} scans in progress
+        self._inflight = {}
+
+    #
+    # Scan message, cached
+    #
+    def check(self, url: str, parts: list[str], key: str) -> dict:
+        while True:
+            with self._lock:
+                result = self._cached(key)
+                if result is not None:
+                    log.debug('cache hit %s', key)
+                    metrics.inc('rspamd_cache_total', result='hit')
+                    return result
+
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self._inflight[key] = threading.Event()
+                    break
+
+            # same message scanned by another thread, failed scan is retried here
+            waiter.wait(sum(self.timeout))
+
+        metrics.inc('rspamd_cache_total', result='miss')
+        try:
+            result = self._scan(url, parts)
+            with self._lock:
+                self._store(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    # message parts sent one after another, never joined into one copy
+    def _scan(self, url: str, parts: list[str]) -> dict:
+        body = _Body([part.encode() for part in parts if part])
+        with self.breaker, self._slots:
+            resp = get_session(url, pool_size=self.max_concurrent).post(
+                url, data=body, timeout=self.timeout
+            )
+
+            if resp.status_code != 200:
+                raise Exception(f'wrong status_code {resp.status_code} from rspamd')
+
+        result = resp.json()
+        if 'score' not in result:
+            raise Exception(f'no score in rspamd response: {result}')
+
+        return result
+
+    # under _lock
+    def _cached(self, key: str) -> dict | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        expires_at, result = entry
+        if expires_at < monotonic():
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return result
+
+    # under _lock
+    def _store(self, key: str, result: dict) -> None:
+        self._cache[key] = (monotonic() + self.cache_ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
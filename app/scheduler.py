@@ -0,0 +1,113 @@
+import logging
+import random
+from collections.abc import Callable
+from time import monotonic
+
+from app.config import PollConfig
+
+log = logging.getLogger('scheduler')
+
+
+#
+# Adaptive per-source polling intervals
+#
+class Scheduler:
+    """Next poll time for every source (ticket system or bucket).
+
+    A source that just changed is polled every `active` seconds, each quiet
+    poll stretches the interval by 1.5x up to `idle`. Off shift every source
+    uses `offshift`. Errors back off exponentially from `idle` up to
+    `backoff_max`. The next poll is planned from the start of the previous
+    one, with +-`jitter` (fraction) to spread the requests.
+    """
+
+    def __init__(
+        self,
+        config: PollConfig,
+        is_working: Callable[[], bool] | None = None,
+    ):
+        self.configure(config)
+        self.is_working = is_working
+
+        # {source: {'next_at', 'interval', 'errors', 'started_at'}}
+        self.sources = {}
+
+    # new intervals apply from the next report of a source
+    def configure(self, config: PollConfig) -> None:
+        self.active = config.active
+        self.idle = config.idle
+        self.offshift = config.offshift
+        self.backoff_max = config.backoff_max
+        self.jitter = config.jitter
+
+    def _source(self, source: str) -> dict:
+        if source not in self.sources:
+            self.sources[source] = {
+                'next_at': 0,
+                'interval': self.active,
+                'errors': 0,
+                'started_at': None,
+            }
+        return self.sources[source]
+
+    def is_due(self, source: str, now: float | None = None) -> bool:
+        if now is None:
+            now = monotonic()
+        return now >= self._source(source)['next_at']
+
+    def start(self, source: str, now: float | None = None) -> None:
+        self._source(source)['started_at'] = monotonic() if now is None else now
+
+    #
+    # Plan next poll after the source finished
+    #
+    def report(self, source: str, active: bool = False, error: bool = False) -> None:
+        state = self._source(source)
+
+        if error:
+            state['errors'] += 1
+            interval = min(self.idle * 2 ** state['errors'], self.backoff_max)
+        else:
+            state['errors'] = 0
+            if self.is_working is not None and self.is_working() is False:
+                interval = self.offshift
+            elif active:
+                interval = self.active
+            else:
+                interval = min(max(state['interval'], self.active) * 1.5, self.idle)
+
+        state['interval'] = interval
+        started_at = state['started_at'] or monotonic()
+        state['next_at'] = started_at + interval * (
+            1 + random.uniform(-self.jitter, self.jitter)
+        )
+        state['started_at'] = None
+
+        log.debug(
+            '%s active:%s error:%s next poll in %.1fs', source, active, error, interval
+        )
+
+    # not polled now, due again in `delay` seconds, interval kept
+    def defer(self, source: str, delay: float, now: float | None = None) -> None:
+        state = self._source(source)
+        state['next_at'] = (monotonic() if now is None else now) + delay
+        log.debug('%s deferred for %.1fs', source, delay)
+
+    # sources leased elsewhere or gone, due at once if they come back
+    def retain(self, sources: set[str]) -> None:
+        for source in self.sources.keys() - sources:
+            del self.sources[source]
+            log.debug('%s dropped', source)
+
+    #
+    # Nearest planned poll of sources not running now
+    #
+    def next_deadline(self) -> float:
+        return min(
+            (
+                state['next_at']
+                for state in self.sources.values()
+                if state['started_at'] is None
+            ),
+            default=monotonic() + self.idle,
+        )
@@ -0,0 +1,208 @@
+import logging
+import random
+from datetime import datetime, timedelta
+from math import ceil
+from time import monotonic
+
+from sqlalchemy import delete, or_, select, update
+
+from app.db import get_db, insert_ignore
+from app.models import SourceLease, TicketClaim
+from app.models import Ticket as TicketModel
+
+log = logging.getLogger('sharding')
+
+# heartbeat lease of a worker, counts workers for the fair share
+WORKER_PREFIX = 'worker:'
+# claims older than this are purged
+CLAIM_RETENTION = timedelta(days=7)
+# purge interval, seconds
+PURGE_INTERVAL = 3600
+
+
+class Shard:
+    """Sources split between workers by lease rows, ticket changes by claims.
+
+    A worker holds at most its fair share of sources, the rest are left to
+    the other live workers. Expires are local time, worker clocks must be
+    in sync.
+    """
+
+    def __init__(self, worker_id: str, lease_ttl: float = 60):
+        self.worker_id = worker_id
+        self.heartbeat = f'{WORKER_PREFIX}{worker_id}'
+        self.lease_ttl = lease_ttl
+        # poller wakes up at least this often to renew
+        self.renew_interval = lease_ttl / 3
+
+        self.owned = set()
+        self.renewed_at = None
+        self.purged_at = monotonic()
+
+    #
+    # Claim and renew source leases, owned sources
+    #
+    def renew(self, sources: list[str]) -> set[str]:
+        now = monotonic()
+        if self.renewed_at is not None and now - self.renewed_at < self.renew_interval:
+            return self.owned
+
+        try:
+            with get_db() as db_session:
+                self.owned = self._acquire(db_session, sources)
+            self.renewed_at = now
+            log.debug('own sources: %s', sorted(self.owned))
+        except Exception as e:
+            log.error('lease renew error: %s', e)
+            # past the ttl other workers may have them
+            if self.renewed_at is None or now - self.renewed_at >= self.lease_ttl:
+                self.owned = set()
+
+        return self.owned
+
+    def _acquire(self, db_session, sources: list[str]) -> set[str]:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.lease_ttl)
+
+        insert_ignore(
+            db_session,
+            SourceLease,
+            [
+                {'source': source, 'owner': None, 'expires_at': now}
+                for source in [*sources, self.heartbeat]
+            ],
+        )
+        db_session.execute(
+            update(SourceLease)
+            .where(SourceLease.source == self.heartbeat)
+            .values(owner=self.worker_id, expires_at=expires_at)
+        )
+
+        workers = len(
+            db_session.scalars(
+                select(SourceLease.source).where(
+                    SourceLease.source.startswith(WORKER_PREFIX),
+                    SourceLease.expires_at >= now,
+                )
+            ).all()
+        )
+        share = ceil(len(sources) / max(workers, 1))
+
+        # renew own
+        db_session.execute(
+            update(SourceLease)
+            .where(
+                SourceLease.source.in_(sources),
+                SourceLease.owner == self.worker_id,
+            )
+            .values(expires_at=expires_at)
+        )
+        owned = set(
+            db_session.scalars(
+                select(SourceLease.source).where(
+                    SourceLease.source.in_(sources),
+                    SourceLease.owner == self.worker_id,
+                )
+            )
+        )
+
+        # more workers now, hand the extra back
+        if len(owned) > share:
+            extra = sorted(owned)[share:]
+            db_session.execute(
+                update(SourceLease)
+                .where(
+                    SourceLease.source.in_(extra),
+                    SourceLease.owner == self.worker_id,
+                )
+                .values(owner=None, expires_at=now)
+            )
+            owned.difference_update(extra)
+            log.info('released sources over fair share: %s', extra)
+
+        # take free and expired up to the share, random order spreads workers
+        free = [source for source in sources if source not in owned]
+        random.shuffle(free)
+        for source in free:
+            if len(owned) >= share:
+                break
+            result = db_session.execute(
+                update(SourceLease)
+                .where(
+                    SourceLease.source == source,
+                    or_(SourceLease.owner.is_(None), SourceLease.expires_at < now),
+                )
+                .values(owner=self.worker_id, expires_at=expires_at)
+            )
+            if result.rowcount:
+                log.info('acquired source %s', source)
+                owned.add(source)
+
+        return owned
+
+    #
+    # Release all leases, on shutdown
+    #
+    def release(self) -> None:
+        try:
+            with get_db() as db_session:
+                db_session.execute(
+                    update(SourceLease)
+                    .where(SourceLease.owner == self.worker_id)
+                    .values(owner=None, expires_at=datetime.now())
+                )
+        except Exception as e:
+            log.error('lease release error: %s', e)
+        self.owned = set()
+
+    #
+    # Tickets whose change this worker claimed, to notify/close
+    #
+    def claim_tickets(self, tickets: list[TicketModel]) -> list[TicketModel]:
+        if not tickets:
+            return []
+
+        now = datetime.now()
+        with get_db() as db_session:
+            # first insert wins, atomic in the db
+            insert_ignore(
+                db_session,
+                TicketClaim,
+                [
+                    {
+                        'mask': ticket.mask,
+                        'updated_at': ticket.updated_at,
+                        'owner': self.worker_id,
+                        'created_at': now,
+                    }
+                    for ticket in tickets
+                ],
+            )
+            claimed = set(
+                db_session.execute(
+                    select(TicketClaim.mask, TicketClaim.updated_at).where(
+                        TicketClaim.mask.in_({ticket.mask for ticket in tickets}),
+                        TicketClaim.owner == self.worker_id,
+                    )
+                ).tuples()
+            )
+
+            if monotonic() - self.purged_at > PURGE_INTERVAL:
+                db_session.execute(
+                    delete(TicketClaim).where(
+                        TicketClaim.created_at < now - CLAIM_RETENTION
+                    )
+                )
+                self.purged_at = monotonic()
+
+        skipped = [
+            ticket.mask
+            for ticket in tickets
+            if (ticket.mask, ticket.updated_at) not in claimed
+        ]
+        if skipped:
+            log.info('claimed by other workers: %s', skipped)
+
+        return [
+            ticket for ticket in tickets if (ticket.mask, ticket.updated_at) in claimed
+        ]
@@ -0,0 +1,282 @@
+import logging
+import re
+import threading
+from typing import NamedTuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import session
+
+from app.db import get_db
+from app.models import SpamscoreList as SpamscoreListModel
+
+log = logging.getLogger('spamlist')
+
+# email/subject/body value with this prefix is a regex (re.search), not a substring
+REGEX_PREFIX = 're:'
+
+# substring fields, body_hash is matched by equality
+TEXT_FIELDS = ('email', 'subject', 'body')
+
+
+class SpamRule(NamedTuple):
+    id: int
+    score: float
+    email: str | None
+    subject: str | None
+    body: str | None
+    body_hash: str | None
+    comment: str | None
+
+
+#
+# Substring index
+#
+class _SubstringIndex:
+    """Finds every pattern occurring in a text, with set operations in C.
+
+    A pattern shorter than KEY_LENGTH is looked up whole among the text
+    substrings of its length. A longer one is filed under one of its
+    KEY_LENGTH-grams, the least shared of a few, and checked with `in`
+    only when the text has that gram.
+    """
+
+    KEY_LENGTH = 8
+
+    def __init__(self, patterns: set[str]):
+        # {length: {pattern}} patterns shorter than KEY_LENGTH
+        self.short: dict[int, set[str]] = {}
+        # {gram: [pattern]} the rest
+        self.long: dict[str, list[str]] = {}
+
+        size = self.KEY_LENGTH
+        for pattern in patterns:
+            if len(pattern) < size:
+                self.short.setdefault(len(pattern), set()).add(pattern)
+                continue
+            last = len(pattern) - size
+            grams = {pattern[i : i + size] for i in (0, last // 3, last * 2 // 3, last)}
+            gram = min(grams, key=lambda gram: len(self.long.get(gram, ())))
+            self.long.setdefault(gram, []).append(pattern)
+
+        self.keys = set(self.long)
+
+    def findall(self, text: str) -> set[str]:
+        found = set()
+
+        for length, patterns in self.short.items():
+            found.update(
+                patterns.intersection(
+                    text[i : i + length] for i in range(len(text) - length + 1)
+                )
+            )
+
+        if self.keys:
+            size = self.KEY_LENGTH
+            grams = {text[i : i + size] for i in range(len(text) - size + 1)}
+            for gram in self.keys.intersection(grams):
+                found.update(pattern for pattern in self.long[gram] if pattern in text)
+
+        return found
+
+
+#
+# Compiled spamscore_list
+#
+class SpamRuleMatcher:
+    """All rules compiled into one matcher.
+
+    Substrings of every field go into one index per field, body_hash into
+    a dict, so a ticket is scanned once whatever the number of rules. Each rule
+    is indexed by a single condition (its anchor) and fully checked only when
+    the anchor hits: every non-null field must match, the first rule in
+    snapshot order (highest score) wins.
+    """
+
+    def __init__(self, rules: tuple[SpamRule, ...]):
+        self.rules = rules
+
+        literals = {field: set() for field in TEXT_FIELDS}
+        # [(rule, literals {field: str}, regexes {field: Pattern})], snapshot order
+        self._compiled = []
+        self._by_hash: dict[str, list[int]] = {}
+        self._by_literal = {field: {} for field in TEXT_FIELDS}
+        self._always: list[int] = []
+
+        for rule in rules:
+            rule_literals = {}
+            rule_regexes = {}
+
+            try:
+                for field in TEXT_FIELDS:
+                    value = getattr(rule, field)
+                    # NULL and '' always pass
+                    if not value:
+                        continue
+                    if value.startswith(REGEX_PREFIX):
+                        rule_regexes[field] = re.compile(value[len(REGEX_PREFIX) :])
+                    else:
+                        rule_literals[field] = value
+            except re.error as e:
+                log.error('spamscore_list id:%s bad regex, skip: %s', rule.id, e)
+                continue
+
+            if not (rule_literals or rule_regexes or rule.body_hash):
+                log.warning('spamscore_list id:%s without conditions, skip', rule.id)
+                continue
+
+            self._compiled.append((rule, rule_literals, rule_regexes))
+            index = len(self._compiled) - 1
+
+            if rule.body_hash:
+                self._by_hash.setdefault(rule.body_hash, []).append(index)
+            elif rule_literals:
+                # longest substring is the rarest one
+                field, value = max(rule_literals.items(), key=lambda x: len(x[1]))
+                self._by_literal[field].setdefault(value, []).append(index)
+            else:
+                self._always.append(index)
+
+            for field, value in rule_literals.items():
+                literals[field].add(value)
+
+        self._indexes = {
+            field: _SubstringIndex(patterns)
+            for field, patterns in literals.items()
+            if patterns
+        }
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    #
+    # Find highest score rule matching the ticket
+    #
+    def match(
+        self, email: str, subject: str, body: str, body_hash: str
+    ) -> SpamRule | None:
+        texts = {'email': email, 'subject': subject, 'body': body}
+        hits = {
+            field: index.findall(texts[field]) for field, index in self._indexes.items()
+        }
+
+        candidates = set(self._always)
+        candidates.update(self._by_hash.get(body_hash, ()))
+        for field, found in hits.items():
+            for value in found:
+                candidates.update(self._by_literal[field].get(value, ()))
+
+        # compiled in snapshot order, lower index is higher score
+        for index in sorted(candidates):
+            rule, rule_literals, rule_regexes = self._compiled[index]
+
+            if rule.body_hash and rule.body_hash != body_hash:
+                continue
+            if any(value not in hits[field] for field, value in rule_literals.items()):
+                continue
+            if any(
+                regex.search(texts[field]) is None
+                for field, regex in rule_regexes.items()
+            ):
+                continue
+
+            return rule
+
+        return None
+
+
+#
+# ticket_spamscore_list cache
+#
+class SpamscoreListCache:
+    """Loads ticket_spamscore_list once and reloads it only when the table changes.
+
+    The version is one aggregate query (row count, max id, score sum and the
+    summed lengths of the match columns), so inserts, deletes and most edits
+    are picked up on the next call. In-place edits that keep every length
+    and score need a bump(), done on SIGHUP.
+    """
+
+    VERSION_COLUMNS = (
+        func.count(SpamscoreListModel.id),
+        func.max(SpamscoreListModel.id),
+        func.sum(SpamscoreListModel.score),
+        func.sum(func.length(SpamscoreListModel.email)),
+        func.sum(func.length(SpamscoreListModel.subject)),
+        func.sum(func.length(SpamscoreListModel.body)),
+        func.sum(func.length(SpamscoreListModel.body_hash)),
+    )
+
+    def __init__(self):
+        self.version = None
+        self.matcher = SpamRuleMatcher(())
+        self._loaded = False
+        # version compiled in the background now
+        self._building = None
+        self._lock = threading.Lock()
+
+    #
+    # Get compiled rules snapshot, highest score first
+    #
+    def get(self, db_session: session) -> SpamRuleMatcher:
+        version = tuple(db_session.query(*self.VERSION_COLUMNS).one())
+
+        with self._lock:
+            if version in (self.version, self._building):
+                return self.matcher
+
+            # nothing to score with yet, the first load blocks
+            if not self._loaded:
+                self._set(version, self._load(db_session))
+                return self.matcher
+
+            # the old snapshot keeps serving while the new one compiles
+            self._building = version
+            threading.Thread(
+                target=self._rebuild, args=(version,), name='spamlist', daemon=True
+            ).start()
+            return self.matcher
+
+    def _rebuild(self, version: tuple) -> None:
+        try:
+            with get_db() as db_session:
+                matcher = self._load(db_session)
+        except Exception as e:
+            log.error('spamscore_list reload error, keep previous: %s', e)
+            matcher = None
+
+        with self._lock:
+            if matcher is not None:
+                self._set(version, matcher)
+            if self._building == version:
+                self._building = None
+
+    def _load(self, db_session: session) -> SpamRuleMatcher:
+        rules = tuple(
+            SpamRule(
+                id=data.id,
+                score=data.score,
+                email=data.email,
+                subject=data.subject,
+                body=data.body,
+                body_hash=data.body_hash,
+                comment=data.comment,
+            )
+            for data in db_session.query(SpamscoreListModel).order_by(
+                SpamscoreListModel.score.desc(), SpamscoreListModel.id
+            )
+        )
+        return SpamRuleMatcher(rules)
+
+    # under _lock
+    def _set(self, version: tuple, matcher: SpamRuleMatcher) -> None:
+        self.matcher = matcher
+        self.version = version
+        self._loaded = True
+        log.debug('spamscore_list reloaded, rules: %s', len(matcher))
+
+    #
+    # Force reload on next get
+    #
+    def bump(self) -> None:
+        with self._lock:
+            self.version = None
@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.metrics import metrics
+from app.models import Ticket as TicketModel
+
+log = logging.getLogger('ticket_batch')
+
+# rows per executemany
+WRITE_CHUNK_SIZE = 1000
+
+
+class TicketBatch:
+    """New tickets and updated_at changes of a cycle, written in one upsert.
+
+    Tickets added here are never added to the session, updated ones are not
+    marked dirty, so the commit issues no per-row statements.
+    """
+
+    def __init__(self):
+        # {mask: row}, last change of a mask wins
+        self.rows = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    #
+    # New ticket
+    #
+    def add(self, ticket: TicketModel) -> None:
+        self.rows[ticket.mask] = {
+            'system_name': ticket.system_name,
+            'mask': ticket.mask,
+            'group': ticket.group,
+            'subject': ticket.subject,
+            'url': ticket.url,
+            'user': ticket.user,
+            'created_at': ticket.created_at or datetime.now(),
+            'updated_at': ticket.updated_at,
+            'spam_score': ticket.spam_score if ticket.spam_score is not None else 0,
+            'autoclose': ticket.autoclose,
+        }
+
+    #
+    # Known ticket, new updated_at
+    #
+    def update(self, ticket: TicketModel, updated_at: datetime) -> None:
+        # the returned ticket shows the new time, without a flush of its own
+        set_committed_value(ticket, 'updated_at', updated_at)
+        self.add(ticket)
+
+    # rows of another batch, same mask is replaced
+    def merge(self, other: 'TicketBatch') -> None:
+        self.rows.update(other.rows)
+
+    #
+    # Upsert by mask, only updated_at changes on existing rows
+    #
+    def write(self, db_session: session) -> None:
+        if not self.rows:
+            return
+
+        rows = list(self.rows.values())
+        dialect = db_session.get_bind().dialect.name
+
+        with metrics.timer('stage_seconds', stage='db', target='upsert'):
+            for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+                chunk = rows[i : i + WRITE_CHUNK_SIZE]
+                if dialect in ('mysql', 'mariadb'):
+                    stmt = mysql.insert(TicketModel)
+                    stmt = stmt.on_duplicate_key_update(
+                        updated_at=stmt.inserted.updated_at
+                    )
+                elif dialect in ('sqlite', 'postgresql'):
+                    insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+                    stmt = insert(TicketModel)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[TicketModel.mask],
+                        set_={'updated_at': stmt.excluded.updated_at},
+                    )
+                else:
+                    self._write_rows(db_session, chunk)
+                    continue
+
+                db_session.execute(stmt, chunk)
+
+        log.debug('upsert %s tickets', len(rows))
+        self.rows = {}
+
+    # no upsert in dialect, update or insert one by one
+    def _write_rows(self, db_session: session, rows: list[dict]) -> None:
+        for row in rows:
+            result = db_session.execute(
+                update(TicketModel)
+                .where(TicketModel.mask == row['mask'])
+                .values(updated_at=row['updated_at'])
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                db_session.execute(TicketModel.__table__.insert(), row)
@@ -1,9 +1,178 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import session
+from xxhash import xxh3_64_hexdigest
+
+from app.circuit import CircuitBreaker
+from app.config import Config, SystemConfig
+from app.mask_filter import mask_filter
+from app.metrics import metrics
+from app.models import Ticket as TicketModel
+from app.ticket_batch import TicketBatch
+
+# max bound params in one IN (...)
+LOOKUP_CHUNK_SIZE = 500
+
+
 class BaseClass:
     SYSTEM_NAME = str
     SYSTEM_URL = str
     AUTH_TOKEN = str
     USER_AGENT = 'zolotarev-bot/0.1'
 
+    def __init__(self, config: Config, system: SystemConfig):
+        self.config = config
+        self.AUTH_TOKEN = system.token
+        # change detection, {fetch key: (page hash, {mask: row hash})}
+        self.seen_hashes = {}
+        # staged by process_tickets, kept only after db commit
+        self._pending_hashes = {}
+        # {fetch key: updated_at}, rows sorted newest first are read down to it
+        self.high_water = {}
+        self._pending_high_water = {}
+        # app.sharding.Shard, set by the poller of a sharded worker
+        self.shard = None
+        # whole system, fed by the fetch jobs in app.poller
+        self.breaker = CircuitBreaker(
+            self.SYSTEM_NAME,
+            failures=config.poll.breaker_failures,
+            reset_timeout=config.poll.breaker_reset,
+        )
+        # {endpoint: CircuitBreaker}
+        self.endpoint_breakers = {}
+
+    # new/updated tickets go to batch, written once per cycle by the caller
+    def process_tickets(
+        self,
+        db_session: session,
+        results: dict | None = None,
+        batch: TicketBatch | None = None,
+    ) -> list[TicketModel]:
+        return []
+
+    def write_batch(self, db_session: session, results: dict) -> list[TicketModel]:
+        batch = TicketBatch()
+        tickets = self.process_tickets(db_session, results, batch)
+        batch.write(db_session)
+        return tickets
+
+    # reloaded config, sizes of executors/caches stay as started
+    def configure(self, config: Config, system: SystemConfig) -> None:
+        self.config = config
+        self.AUTH_TOKEN = system.token
+        for breaker in [self.breaker, *self.endpoint_breakers.values()]:
+            breaker.failures = config.poll.breaker_failures
+            breaker.reset_timeout = config.poll.breaker_reset
+
+    # `with self.endpoint_breaker(target):` around a request
+    def endpoint_breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.endpoint_breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.endpoint_breakers.setdefault(
+                endpoint,
+                CircuitBreaker(
+                    f'{self.SYSTEM_NAME}:{endpoint}',
+                    failures=self.config.poll.breaker_failures,
+                    reset_timeout=self.config.poll.breaker_reset,
+                ),
+            )
+        return breaker
+
+    # cached db data dropped, on SIGHUP
+    def reload(self) -> None:
+        pass
+
+    # background work of process_tickets, it is called again once any is done
+    def pending_work(self) -> list[Future]:
+        return []
+
+    # executors/connections of the system, on shutdown
+    def close(self) -> None:
+        pass
+
+    # changes this worker notifies/closes, all of them when not sharded
+    def claim_tickets(self, tickets: list[TicketModel]) -> list[TicketModel]:
+        if self.shard is None:
+            return tickets
+        return self.shard.claim_tickets(tickets)
+
+    # {key: callable}, network only, run concurrently by app.poller
+    # callable returns {'hash': page hash | None, 'rows': [row]}, None if page unchanged
+    def fetch_jobs(self) -> dict:
+        return {}
+
+    #
+    # Change detection
+    #
+    def is_page_seen(self, key: str, page_hash: str) -> bool:
+        return self.seen_hashes.get(key, (None, {}))[0] == page_hash
+
+    def changed_rows(self, key: str, rows: list[dict]) -> list[dict]:
+        seen = self.seen_hashes.get(key, (None, {}))[1]
+        return [row for row in rows if seen.get(row['mask']) != row_hash(row)]
+
+    def stage_hashes(
+        self, key: str, page: dict, deferred: set[str] | None = None
+    ) -> None:
+        # deferred rows, and so the page, must be checked again next cycle
+        deferred = {row['mask'] for row in page['rows']} & (deferred or set())
+        self._pending_hashes[key] = (
+            None if deferred else page['hash'],
+            {
+                row['mask']: row_hash(row)
+                for row in page['rows']
+                if row['mask'] not in deferred
+            },
+        )
+
+        # deferred rows must be read again, keep the mark at the oldest of them
+        if deferred:
+            self._pending_high_water[key] = min(
+                row['updated_at'] for row in page['rows'] if row['mask'] in deferred
+            )
+        elif page['rows']:
+            self._pending_high_water[key] = max(
+                row['updated_at'] for row in page['rows']
+            )
+
+    def commit_hashes(self) -> None:
+        self.seen_hashes.update(self._pending_hashes)
+        self._pending_hashes = {}
+        self.high_water.update(self._pending_high_water)
+        self._pending_high_water = {}
+
+    def rollback_hashes(self) -> None:
+        self._pending_hashes = {}
+        self._pending_high_water = {}
+
+    #
+    # Lookup tickets by masks, one query per batch
+    #
+    def lookup_tickets(
+        self, db_session: session, masks: set[str]
+    ) -> dict[str, TicketModel]:
+        tickets = {}
+
+        with metrics.timer(
+            'stage_seconds', system=self.SYSTEM_NAME, stage='db', target='lookup'
+        ):
+            # masks missing from the filter are new, not queried
+            mask_filter.sync(db_session)
+            masks = [mask for mask in masks if mask_filter.maybe_known(mask)]
+            for i in range(0, len(masks), LOOKUP_CHUNK_SIZE):
+                for ticket in db_session.query(TicketModel).filter(
+                    TicketModel.mask.in_(masks[i : i + LOOKUP_CHUNK_SIZE])
+                ):
+                    tickets[ticket.mask] = ticket
+
+        return tickets
+
+    # unknown and idle past retention, archived by app.retention, not new
+    def is_archived(self, updated_at: datetime) -> bool:
+        days = self.config.retention_days
+        return days > 0 and updated_at < datetime.now() - timedelta(days=days)
+
 
-def process_tickets(self, db_session):
-    pass
+def row_hash(row: dict) -> str:
+    return xxh3_64_hexdigest('\x1f'.join(f'{key}={row[key]}' for key in sorted(row)))
@@ -1,19 +1,39 @@
 import logging
-import os
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from itertools import pairwise
+from time import monotonic
 
-import requests
-from bs4 import BeautifulSoup
-from xxhash import xxh128_hexdigest
+from xxhash import xxh3_64_hexdigest, xxh128_hexdigest
 
 from sqlalchemy.orm import session
-from app.models import SpamscoreList as SpamscoreListModel
+from app import autoclose
+from app.artifact_cache import ArtifactCache
+from app.config import Config, SystemConfig
+from app.cpu_pool import CpuPool
+from app.http_client import get_session
+from app.metrics import metrics
 from app.models import Ticket as TicketModel
+from app.rspamd import RspamdClient, cache_key, relay_matcher, split_headers
+from app.spamlist import SpamRuleMatcher, SpamscoreListCache
+from app.ticket_batch import TicketBatch
 from app.tsystem.base import BaseClass
+from app.tsystem.cerb_html import (
+    MASK_RE,
+    parse_conversation,
+    parse_counters,
+    parse_textarea,
+    parse_worklist,
+    parse_worklist_total,
+)
 
 log = logging.getLogger('tsystem.cerb')
 
+# timed out scorings of a ticket before it is added unscored
+SCORE_ATTEMPTS = 3
+
 
 class Cerb(BaseClass):
     SYSTEM_NAME = 'Cerberus'
@@ -21,74 +41,295 @@ class Cerb(BaseClass):
     CERT_PATH = str
     BUCKETS = list[int]
 
-    def __init__(self, token: str, buckets: list[int]):
-        self.AUTH_TOKEN = token
-        self.BUCKETS = buckets
+    def __init__(self, config: Config, system: SystemConfig):
+        super().__init__(config, system)
+        self.BUCKETS = list(system.buckets)
+        self.spamscore_list = SpamscoreListCache()
+
+        # new tickets scoring, and independent requests inside one scoring
+        score_workers = config.cerb.score_workers
+        self.score_executor = ThreadPoolExecutor(
+            max_workers=score_workers, thread_name_prefix='cerb-score'
+        )
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=score_workers * 2, thread_name_prefix='cerb-io'
+        )
+        # {mask: (future, row)} new tickets being scored, kept across cycles
+        self._scoring = {}
+        # {mask: monotonic time}, set by the worker when scoring starts
+        self._score_started = {}
+        # {mask: timed out attempts}
+        self._score_timeouts = {}
+
+        # worklists and conversations parsed in other processes, optional
+        self.cpu = CpuPool(config.cerb.parse_workers)
+
+        # original messages and headers dont change, keep them between restarts
+        self.artifacts = ArtifactCache(
+            path=config.cerb.artifact_cache_path,
+            memory_bytes=config.cerb.artifact_cache_memory_mb * 1024 * 1024,
+            disk_bytes=config.cerb.artifact_cache_disk_mb * 1024 * 1024,
+        )
+
+        # buckets sorted by updated date desc in the worker session
+        self.sorted_buckets = set()
+
+        # campaign messages are scored once per cache_ttl
+        self.rspamd = RspamdClient(
+            connect_timeout=config.cerb.rspamd_connect_timeout,
+            read_timeout=config.cerb.rspamd_timeout,
+            max_concurrent=config.cerb.rspamd_concurrency,
+            cache_size=config.cerb.rspamd_cache_size,
+            cache_ttl=config.cerb.rspamd_cache_ttl,
+            breaker=self.endpoint_breaker('rspamd'),
+        )
+
+        # spam tickets closed concurrently, a slow close never blocks polling
+        self.autocloser = autoclose.Autocloser(
+            self.close_ticket,
+            system_name=self.SYSTEM_NAME,
+            workers=config.cerb.autoclose_workers,
+            retries=config.cerb.autoclose_retries,
+            retry_interval=config.cerb.autoclose_retry_interval,
+        )
+        # (mask, ticket id, mark spam) of the cycle, submitted after commit
+        self._pending_closes = []
+
+    # timeouts, ttl and retries of the reloaded config, sizes stay as started
+    def configure(self, config: Config, system: SystemConfig) -> None:
+        super().configure(config, system)
+        self.rspamd.timeout = (
+            config.cerb.rspamd_connect_timeout,
+            config.cerb.rspamd_timeout,
+        )
+        self.rspamd.cache_ttl = config.cerb.rspamd_cache_ttl
+        self.autocloser.retries = config.cerb.autoclose_retries
+        self.autocloser.retry_interval = config.cerb.autoclose_retry_interval
 
     #
-    # Parse tickets
+    # Fetch jobs
     #
-    def process_tickets(self, db_session: session) -> list[TicketModel]:
-        tickets = []
+    def fetch_jobs(self) -> dict:
+        return {
+            f'bucket:{bucket_id}': partial(self.fetch_bucket, bucket_id)
+            for bucket_id in self.BUCKETS
+        }
 
-        for bucket_id in self.BUCKETS:
-            log.debug(f'parse bucket_id: {bucket_id}')
-            # Get bucket tickets html
-            bucket_html = self._req_get(
-                f'{self.SYSTEM_URL}/ajax.php?c=internal&a=viewRefresh&id=cust_{bucket_id}'
+    #
+    # Fetch bucket, newest updated first
+    #
+    def fetch_bucket(self, bucket_id: int) -> dict | None:
+        key = f'bucket:{bucket_id}'
+        log.debug('parse bucket_id: %s', bucket_id)
+
+        if bucket_id not in self.sorted_buckets:
+            self._sort_bucket(bucket_id)
+
+        # Get bucket tickets html
+        bucket_html = self._req_get(self._worklist_url(bucket_id), target='worklist')
+
+        # same page as last cycle, nothing to parse
+        # sorted by updated date, so nothing changed on the next pages either
+        bucket_hash = xxh3_64_hexdigest(bucket_html)
+        if self.is_page_seen(key, bucket_hash):
+            log.debug('bucket_id: %s not changed, skip', bucket_id)
+            return None
+
+        bucket_name, bucket_rows = self._parse_bucket(bucket_html)
+        log.debug('found bucket_name: %s', bucket_name)
+
+        rows = self._bucket_rows(bucket_name, bucket_rows)
+
+        if _is_sorted(rows):
+            rows.extend(
+                self._fetch_pages(
+                    bucket_id,
+                    bucket_name,
+                    rows,
+                    self.high_water.get(key),
+                    parse_worklist_total(bucket_html),
+                )
             )
-            bucket_soup = BeautifulSoup(bucket_html, 'html.parser')
-            bucket_name = bucket_soup.find('span', {'class': 'title'}).text
-            log.debug(f'found bucket_name: {bucket_name}')
-
-            # parse bucket tickets
-            for bucket_ticket in bucket_soup.find(
-                'table', {'class': 'worklistBody'}
-            ).find_all('tbody'):
-                # get local_id
-                ticket_local_id = bucket_ticket.find('input', {'name': 'ticket_id[]'})[
-                    'value'
+        else:
+            # worker session lost the sort, first page only this cycle
+            log.warning('bucket_id: %s not sorted by updated date', bucket_id)
+            self.sorted_buckets.discard(bucket_id)
+
+        return {'hash': bucket_hash, 'rows': rows}
+
+    #
+    # Next pages while rows are above the high-water mark
+    #
+    def _fetch_pages(
+        self,
+        bucket_id: int,
+        bucket_name: str,
+        first_rows: list[dict],
+        high_water: datetime | None,
+        total: int | None = None,
+    ) -> list[dict]:
+        rows = []
+        page_size = len(first_rows)
+        seen_ids = {row['local_id'] for row in first_rows}
+        last_rows = first_rows
+        page = 1
+
+        # footer total known, dont ask for pages past the end
+        max_pages = self.config.cerb.max_pages
+        if total is not None and page_size:
+            max_pages = min(max_pages, -(-total // page_size))
+
+        while page < max_pages and _has_more(last_rows, page_size, high_water):
+            # burst past one page, fetch a few next pages at once
+            pages = range(page, min(page + self.config.cerb.page_parallel, max_pages))
+            log.debug('bucket_id: %s fetch pages %s', bucket_id, list(pages))
+            futures = [
+                self.io_executor.submit(
+                    self._req_get, self._worklist_url(bucket_id, p), 'worklist'
+                )
+                for p in pages
+            ]
+
+            for future in futures:
+                _, bucket_rows = self._parse_bucket(future.result())
+                # rows shift between pages while they are fetched
+                last_rows = [
+                    row
+                    for row in self._bucket_rows(bucket_name, bucket_rows)
+                    if row['local_id'] not in seen_ids
                 ]
-                log.debug(f'found ticket_local_id: {ticket_local_id}')
-
-                # get subject
-                ticket_subject = bucket_ticket.find('a', {'class': 'subject'}).text
-                log.debug(f'found ticket_subject: {ticket_subject}')
-
-                # get url
-                ticket_url = f'{self.SYSTEM_URL}{bucket_ticket.find("a", {"class": "subject"})["href"]}'
-                log.debug(f'found ticket_url: {ticket_url}')
-
-                # get mask
-                ticket_mask = re.match(
-                    'https://cerberus.majordomo.ru/index.php/profiles/ticket/(.*)/conversation',
-                    ticket_url,
-                ).group(1)
-                log.debug(f'found ticket_mask {ticket_mask}')
-
-                # service dont have from
-                if bucket_name == 'Service':
-                    ticket_user = 'noreply@majordomo.ru'
-                else:
-                    # get user
-                    ticket_user = bucket_ticket.find(
-                        'a', {'data-context': 'cerberusweb.contexts.address'}
-                    ).text
-                log.debug(f'found ticket_user: {ticket_user}')
-
-                # get updated_at
-                ticket_updated_at = bucket_ticket.find(
-                    'td', {'data-column': 't_updated_date'}
-                )['data-timestamp']
-                ticket_updated_at = datetime.fromtimestamp(int(ticket_updated_at))
-                log.debug(f'found ticket_updated_at: {ticket_updated_at}')
-
-                ticket_spamscore = 0
-
-                # check in db by mask
-                ticket = (
-                    db_session.query(TicketModel).filter_by(mask=ticket_mask).first()
+                seen_ids.update(row['local_id'] for row in last_rows)
+                rows.extend(last_rows)
+                page += 1
+
+                if not _has_more(last_rows, page_size, high_water):
+                    break
+
+            for future in futures:
+                future.cancel()
+
+        return rows
+
+    #
+    # Sort worklist by updated date, desc
+    #
+    def _sort_bucket(self, bucket_id: int) -> None:
+        # viewSortBy toggles asc/desc on the same column
+        for _ in range(2):
+            _, bucket_rows = self._parse_bucket(
+                self._req_get(
+                    f'{self.SYSTEM_URL}/ajax.php?c=internal&a=viewSortBy&id=cust_{bucket_id}&sortBy=t_updated_date',
+                    target='worklist',
                 )
+            )
+            updated = [int(row['updated_at']) for row in bucket_rows]
+            if updated == sorted(updated, reverse=True):
+                log.debug('bucket_id: %s sorted by updated date', bucket_id)
+                self.sorted_buckets.add(bucket_id)
+                return
+
+        log.warning('bucket_id: %s cant sort by updated date', bucket_id)
+
+    def _worklist_url(self, bucket_id: int, page: int = 0) -> str:
+        if page == 0:
+            return f'{self.SYSTEM_URL}/ajax.php?c=internal&a=viewRefresh&id=cust_{bucket_id}'
+        return f'{self.SYSTEM_URL}/ajax.php?c=internal&a=viewPage&id=cust_{bucket_id}&page={page}'
+
+    def _parse_bucket(self, bucket_html: str) -> tuple[str, list[dict]]:
+        with metrics.timer(
+            'stage_seconds', system=self.SYSTEM_NAME, stage='parse', target='worklist'
+        ):
+            return self.cpu.run(parse_worklist, bucket_html)
+
+    def _bucket_rows(self, bucket_name: str, bucket_rows: list[dict]) -> list[dict]:
+        rows = []
+
+        # parse bucket tickets
+        for bucket_ticket in bucket_rows:
+            # get local_id
+            ticket_local_id = bucket_ticket['local_id']
+            log.debug('found ticket_local_id: %s', ticket_local_id)
+
+            # get subject
+            ticket_subject = bucket_ticket['subject']
+            log.debug('found ticket_subject: %s', ticket_subject)
+
+            # get url
+            ticket_url = f'{self.SYSTEM_URL}{bucket_ticket["href"]}'
+            log.debug('found ticket_url: %s', ticket_url)
+
+            # get mask
+            ticket_mask = MASK_RE.search(bucket_ticket['href']).group(1)
+            log.debug('found ticket_mask %s', ticket_mask)
+
+            # service dont have from
+            if bucket_name == 'Service':
+                ticket_user = 'noreply@majordomo.ru'
+            else:
+                # get user
+                ticket_user = bucket_ticket['user']
+            log.debug('found ticket_user: %s', ticket_user)
+
+            # get updated_at
+            ticket_updated_at = datetime.fromtimestamp(int(bucket_ticket['updated_at']))
+            log.debug('found ticket_updated_at: %s', ticket_updated_at)
+
+            rows.append(
+                {
+                    'local_id': int(ticket_local_id),
+                    'mask': ticket_mask,
+                    'group': bucket_name,
+                    'subject': ticket_subject,
+                    'url': ticket_url,
+                    'user': ticket_user,
+                    'updated_at': ticket_updated_at,
+                }
+            )
+
+        return rows
+
+    #
+    # Parse tickets
+    #
+    def process_tickets(
+        self,
+        db_session: session,
+        results: dict | None = None,
+        batch: TicketBatch | None = None,
+    ) -> list[TicketModel]:
+        tickets = []
+        # new tickets, scored after the whole batch is parsed
+        new_rows = {}
+        # new tickets too young to score, checked again next cycle
+        deferred = set()
+
+        # standalone call, fetch buckets one by one, write at the end
+        if results is None:
+            results = {key: job() for key, job in self.fetch_jobs().items()}
+        if batch is None:
+            return self.write_batch(db_session, results)
+
+        # unchanged pages are None, unchanged rows are dropped
+        changed = {
+            key: self.changed_rows(key, page['rows'])
+            for key, page in results.items()
+            if page is not None
+        }
+
+        # check in db by mask, whole batch at once
+        known_tickets = self.lookup_tickets(
+            db_session, {row['mask'] for rows in changed.values() for row in rows}
+        )
+
+        for rows in changed.values():
+            metrics.inc(
+                'tickets_total', len(rows), system=self.SYSTEM_NAME, state='seen'
+            )
+            for row in rows:
+                ticket_mask = row['mask']
+                ticket_updated_at = row['updated_at']
+
+                ticket = known_tickets.get(ticket_mask)
 
                 if ticket is not None:
                     log.debug('found mask in Database')
@@ -98,80 +339,223 @@ class Cerb(BaseClass):
                     else:
                         if (ticket_updated_at - ticket.updated_at).total_seconds() < 61:
                             log.debug('dont double notify < 1min, update time and skip')
-                            ticket.updated_at = ticket_updated_at
-                            db_session.flush()
+                            batch.update(ticket, ticket_updated_at)
                         else:
                             log.debug('updated ticket, add to rval')
-                            ticket.updated_at = ticket_updated_at
-                            db_session.flush()
+                            batch.update(ticket, ticket_updated_at)
+                            metrics.inc(
+                                'tickets_total',
+                                system=self.SYSTEM_NAME,
+                                state='updated',
+                            )
                             tickets.append(ticket)
 
-                else:
+                elif ticket_mask not in new_rows:
+                    if self.is_archived(ticket_updated_at):
+                        log.debug('archived ticket, skip')
+                        continue
+
                     log.debug('found new ticket')
 
                     if (datetime.now() - ticket_updated_at).total_seconds() < 61:
                         log.debug(
                             'wait cerb_bot attach hms/billing 1min after created, skip'
                         )
+                        deferred.add(ticket_mask)
                         continue
 
-                    # get spamscore ticket
-                    if os.getenv('ENABLE_SPAM_SCORE') == '1':
-                        log.debug('get spamscore')
-                        spamscore_list = (
-                            db_session.query(SpamscoreListModel)
-                            .order_by(SpamscoreListModel.score.desc())
-                            .all()
-                        )
-                        ticket_spamscore = self.spamscore_ticket(
-                            ticket_mask, spamscore_list
-                        )
-                        log.debug(f'found spamscore: {ticket_spamscore}')
-
-                    ticket = TicketModel(
-                        local_id=int(ticket_local_id),
-                        system_name=self.SYSTEM_NAME,
-                        mask=ticket_mask,
-                        group=bucket_name,
-                        subject=ticket_subject,
-                        url=ticket_url,
-                        user=ticket_user,
-                        updated_at=ticket_updated_at,
-                        spam_score=ticket_spamscore,
-                    )
+                    new_rows[ticket_mask] = row
 
-                    log.debug('add ticket to database')
-                    db_session.add(ticket)
-
-                    # autoclose tickets
-                    if os.getenv('ENABLE_AUTOCLOSE') == '1':
-                        if ticket.spam_score >= int(os.getenv('AUTOCLOSE_MIN_SCORE')):
-                            mark_spam = True
-                            # just close, dont mark spam useless tickets from spamlist, should be score >100
-                            if ticket.spam_score >= 100:
-                                mark_spam = False
-                            self.close_ticket(ticket.local_id, mark_spam)
-                            log.info(
-                                f'autoclosed ticket mask:{ticket.mask} with spam_mark:{mark_spam}, skip'
-                            )
-                            continue
-                    log.debug('add ticket to rval')
-                    tickets.append(ticket)
+        # scored in the background, added once the score is ready, rows of
+        # tickets still scoring are read again next cycle
+        scores = {}
+        if self.config.cerb.spam_score:
+            scored = self.score_tickets(
+                list(new_rows.values()), self.spamscore_list.get(db_session)
+            )
+            deferred.update(mask for mask in new_rows if mask not in scored)
+            new_rows = {mask: row for mask, (row, _) in scored.items()}
+            scores = {mask: score for mask, (_, score) in scored.items()}
+        elif self._scoring:
+            # switched off on reload, scores already done are kept
+            self._cancel_scoring()
+            scored = self.score_tickets([], None)
+            # still running, added once done
+            deferred.update(mask for mask in new_rows if mask in self._scoring)
+            new_rows = {
+                mask: row for mask, row in new_rows.items() if mask not in self._scoring
+            }
+            new_rows.update((mask, row) for mask, (row, _) in scored.items())
+            scores = {mask: score for mask, (_, score) in scored.items()}
+
+        for key in changed:
+            self.stage_hashes(key, results[key], deferred)
+
+        new_tickets = []
+        for ticket_mask, row in new_rows.items():
+            ticket = TicketModel(
+                system_name=self.SYSTEM_NAME,
+                spam_score=scores.get(ticket_mask, 0),
+                **row,
+            )
+
+            log.debug('add ticket to database')
+            batch.add(ticket)
+            metrics.inc('tickets_total', system=self.SYSTEM_NAME, state='new')
+            new_tickets.append(ticket)
+
+        # sharded workers, notify/close only the changes claimed here
+        claimed = self.claim_tickets([*tickets, *new_tickets])
+        tickets = [ticket for ticket in claimed if ticket.mask not in new_rows]
+
+        for ticket in claimed:
+            if ticket.mask not in new_rows:
+                continue
+
+            # autoclose tickets
+            if self.config.cerb.autoclose == '1':
+                if ticket.spam_score >= self.config.cerb.autoclose_min_score:
+                    mark_spam = True
+                    # just close, dont mark spam useless tickets from spamlist, should be score >100
+                    if ticket.spam_score >= 100:
+                        mark_spam = False
+                    # closed after the row is committed, see commit_hashes
+                    ticket.autoclose = autoclose.PENDING
+                    batch.add(ticket)
+                    self.autocloser.queue(
+                        db_session, ticket.mask, ticket.local_id, mark_spam
+                    )
+                    self._pending_closes.append(
+                        (ticket.mask, ticket.local_id, mark_spam)
+                    )
+                    log.info(
+                        'autoclose queued mask:%s with spam_mark:%s, skip',
+                        ticket.mask,
+                        mark_spam,
+                    )
+                    continue
+            log.debug('add ticket to rval')
+            tickets.append(ticket)
 
         return tickets
 
+    #
+    # Queued closes start only once their rows are in the db
+    #
+    def commit_hashes(self) -> None:
+        super().commit_hashes()
+        for mask, ticket_id, mark_spam in self._pending_closes:
+            self.autocloser.submit(mask, ticket_id, mark_spam)
+        self._pending_closes = []
+        # left by a restart or failed, closed only while autoclose is on
+        if self.config.cerb.autoclose == '1':
+            self.autocloser.resume()
+
+    def rollback_hashes(self) -> None:
+        super().rollback_hashes()
+        # tickets are new again next cycle
+        self._pending_closes = []
+
+    # in-place spamscore_list edits its version doesnt see
+    def reload(self) -> None:
+        self.spamscore_list.bump()
+
+    def pending_work(self) -> list[Future]:
+        return [future for future, _ in self._scoring.values()]
+
+    def close(self) -> None:
+        self.autocloser.shutdown()
+        self.cpu.shutdown()
+        self.score_executor.shutdown(wait=False, cancel_futures=True)
+        self.io_executor.shutdown(wait=False, cancel_futures=True)
+        self.artifacts.close()
+
+    #
+    # Score new tickets concurrently, never waits for them
+    #
+    def score_tickets(
+        self, rows: list[dict], spamscore_list: SpamRuleMatcher | None
+    ) -> dict[str, tuple[dict, float]]:
+        """Queue scoring of rows not queued yet, {mask: (row, score)} of every
+        finished one, of this or an earlier cycle.
+
+        A ticket still scoring `score_timeout` seconds after its scoring
+        started is given up, its row is scored again when it is read again.
+        After SCORE_ATTEMPTS timeouts it is added with score 0.
+        """
+        for row in rows:
+            if row['mask'] not in self._scoring:
+                future = self.score_executor.submit(
+                    self._score_ticket, row['mask'], spamscore_list, row['local_id']
+                )
+                self._scoring[row['mask']] = (future, row)
+        if rows:
+            log.debug('spamscore queued: %s', len(self._scoring))
+
+        scored = {}
+        now = monotonic()
+        for ticket_mask, (future, row) in list(self._scoring.items()):
+            if future.done():
+                scored[ticket_mask] = (row, future.result())
+                self._score_timeouts.pop(ticket_mask, None)
+                log.debug('found spamscore %s: %s', ticket_mask, scored[ticket_mask][1])
+            else:
+                started_at = self._score_started.get(ticket_mask)
+                if (
+                    started_at is None
+                    or now - started_at < self.config.cerb.score_timeout
+                ):
+                    continue
+                # the worker ends on its http timeouts, result dropped
+                timeouts = self._score_timeouts.get(ticket_mask, 0) + 1
+                if timeouts < SCORE_ATTEMPTS:
+                    log.error('[spamscore][%s] timeout exceeded, retry', ticket_mask)
+                    self._score_timeouts[ticket_mask] = timeouts
+                else:
+                    log.error('[spamscore][%s] timeout exceeded, score 0', ticket_mask)
+                    scored[ticket_mask] = (row, 0)
+                    self._score_timeouts.pop(ticket_mask, None)
+            del self._scoring[ticket_mask]
+            self._score_started.pop(ticket_mask, None)
+
+        return scored
+
+    # queued scorings dropped, running ones are drained as they finish
+    def _cancel_scoring(self) -> None:
+        for ticket_mask, (future, _) in list(self._scoring.items()):
+            if future.cancel():
+                del self._scoring[ticket_mask]
+
+    def _score_ticket(
+        self, ticket_mask: str, spamscore_list: SpamRuleMatcher, ticket_id: int
+    ) -> float:
+        self._score_started[ticket_mask] = monotonic()
+        return self.spamscore_ticket(ticket_mask, spamscore_list, ticket_id)
+
     #
     # ticket spamscore
     #
     def spamscore_ticket(
-        self, ticket_mask: str, spamscore_list: list[SpamscoreListModel]
+        self,
+        ticket_mask: str,
+        spamscore_list: SpamRuleMatcher,
+        ticket_id: int | None = None,
     ) -> float:
         score = 0
+        ticket_msg_req = None
 
         try:
-            ticket_html = self._req_get(
-                f'{self.SYSTEM_URL}/index.php/profiles/ticket/{ticket_mask}/conversation'
-            )
+            # ticket_id known from worklist, get conversation along with profile
+            if ticket_id is not None:
+                ticket_msg_req = self.io_executor.submit(
+                    self._req_get, self._conversation_url(ticket_id), 'conversation'
+                )
+
+            with self._step_timer('profile'):
+                ticket_html = self._req_get(
+                    f'{self.SYSTEM_URL}/index.php/profiles/ticket/{ticket_mask}/conversation',
+                    target='profile',
+                )
 
             # check hms/billing buttons
             # TODO: links already button to... https://cerberus.intr/index.php/profiles/ticket/KP-99687-833/conversation
@@ -179,209 +563,123 @@ class Cerb(BaseClass):
                 ticket_html.find('<div style="color:rgb(175,175,175);">(none)</div>')
                 == -1
             ):
-                log.debug(f'[spamscore][{ticket_mask}] found buttons')
+                log.debug('[spamscore][%s] found buttons', ticket_mask)
                 score += -99
                 # force return
                 return score
 
             # Check msg/comm count
-            ticket_soup = BeautifulSoup(ticket_html, 'html.parser')
-            msg_count = int(
-                ticket_soup.find(
-                    'button',
-                    {
-                        'class': 'cerb-search-trigger',
-                        'data-context': 'cerberusweb.contexts.message',
-                    },
-                ).div.text
-            )
-            com_count = int(
-                ticket_soup.find(
-                    'button',
-                    {
-                        'class': 'cerb-search-trigger',
-                        'data-context': 'cerberusweb.contexts.comment',
-                    },
-                ).div.text
-            )
+            msg_count, com_count = self.cpu.run(parse_counters, ticket_html)
             log.debug(
-                f'[spamscore][{ticket_mask}] messages: {msg_count}, comments: {com_count}'
+                '[spamscore][%s] messages: %s, comments: %s',
+                ticket_mask,
+                msg_count,
+                com_count,
             )
             if msg_count > 1 or com_count > 1:
-                log.debug(f'[spamscore][{ticket_mask}] found conversation')
+                log.debug('[spamscore][%s] found conversation', ticket_mask)
                 score += -50
                 # force return
                 return score
 
-            # get ticket id
-            ticket_id = re.findall(r'ticket_id=(\d+)', ticket_html)[0]
-            log.debug(f'[spamscore][{ticket_mask}] found ticket_id: {ticket_id}')
-            # get conversation ticket
-            ticket_msg_html = self._req_get(
-                f'{self.SYSTEM_URL}/ajax.php?c=display&a=showConversation&point=cerberusweb.profiles.ticket&ticket_id={ticket_id}&expand_all=1'
-            )
+            with self._step_timer('conversation'):
+                if ticket_msg_req is None:
+                    # get ticket id
+                    ticket_id = re.findall(r'ticket_id=(\d+)', ticket_html)[0]
+                    log.debug(
+                        '[spamscore][%s] found ticket_id: %s', ticket_mask, ticket_id
+                    )
+                    # get conversation ticket
+                    ticket_msg_html = self._req_get(
+                        self._conversation_url(ticket_id), target='conversation'
+                    )
+                else:
+                    ticket_msg_html = ticket_msg_req.result()
+
+                # conversation sender and body nodes
+                ticket_email, ticket_msg_bodies = self.cpu.run(
+                    parse_conversation, ticket_msg_html
+                )
+
             # get first msg id
             ticket_msg_id = re.findall(
                 r'c=profiles&a=handleSectionAction&section=ticket&action=showMessageFullHeadersPopup&id=(\d+)',
                 ticket_msg_html,
             )[0]
-            log.debug(f'[spamscore][{ticket_mask}] found msg_id: {ticket_msg_id}')
-
-            # conversation soap
-            ticket_msg_soap = BeautifulSoup(ticket_msg_html, 'html.parser')
+            log.debug('[spamscore][%s] found msg_id: %s', ticket_mask, ticket_msg_id)
+
+            # get headers, along with body
+            ticket_headers_req = self.io_executor.submit(
+                self._req_artifact,
+                f'headers:{ticket_msg_id}',
+                f'{self.SYSTEM_URL}/ajax.php?c=profiles&a=handleSectionAction&section=ticket&action=showMessageFullHeadersPopup&id={ticket_msg_id}',
+                'headers',
+            )
 
             # get ticket from email
-            try:
-                ticket_email = ticket_msg_soap.find(
-                    'a', {'data-context': 'cerberusweb.contexts.address'}
-                ).text
+            if ticket_email is not None:
                 ticket_email = ticket_email.replace('<', '').replace('>', '')
-            except:
+            else:
                 # Possibly msg from us
                 # UK-92725-469
                 ticket_email = 'undefined'
-            log.debug(f'[spamscore][{ticket_mask}] found ticket_email: {ticket_email}')
+            log.debug(
+                '[spamscore][%s] found ticket_email: %s', ticket_mask, ticket_email
+            )
 
             # get subject
             ticket_subject = re.findall(r'<b>Subject:</b>\s(.*)<br>', ticket_msg_html)
             if len(ticket_subject) > 0:
                 ticket_subject = ticket_subject[0]
                 log.debug(
-                    f'[spamscore][{ticket_mask}] found ticket_subject: "{ticket_subject}"'
+                    '[spamscore][%s] found ticket_subject: "%s"',
+                    ticket_mask,
+                    ticket_subject,
                 )
             else:
                 ticket_subject = '(no subject)'
-                log.debug(f'[spamscore][{ticket_mask}] not found ticket_subject')
+                log.debug('[spamscore][%s] not found ticket_subject', ticket_mask)
 
-            # get headers
-            ticket_headers = self._req_get(
-                f'{self.SYSTEM_URL}/ajax.php?c=profiles&a=handleSectionAction&section=ticket&action=showMessageFullHeadersPopup&id={ticket_msg_id}'
-            )
-            _ticket_headers = BeautifulSoup(ticket_headers, 'html.parser').textarea.text
+            # get body
+            with self._step_timer('body'):
+                ticket_body = self._ticket_body(
+                    ticket_mask, ticket_msg_html, ticket_msg_bodies
+                )
+
+            # wait headers
+            with self._step_timer('headers'):
+                ticket_headers = ticket_headers_req.result()
+                _ticket_headers = self.cpu.run(parse_textarea, ticket_headers)
             _ticket_headers = _ticket_headers.split('\n')
             if _ticket_headers[0] == '':
                 ticket_headers = '\n'.join(_ticket_headers[1:])
             else:
                 ticket_headers = '\n'.join(_ticket_headers)
             log.debug(
-                f'[spamscore][{ticket_mask}] found ticket_headers: len({len(ticket_headers)})'
+                '[spamscore][%s] found ticket_headers: len(%s)',
+                ticket_mask,
+                len(ticket_headers),
             )
 
-            # get body
-            ticket_body_url = re.findall(
-                r'(/index.php/files/\d+/original_message.html)', ticket_msg_html
-            )
-            # from original_message.html
-            if len(ticket_body_url) > 0:
-                ticket_body = self._req_get(f'{self.SYSTEM_URL}{ticket_body_url[0]}')
-                log.debug(
-                    f'[spamscore][{ticket_mask}] found ticket_body from original_message: len({len(ticket_body)})'
-                )
-            else:
-                if ticket_msg_html.find('emailBodyHtml') >= 0:
-                    ticket_body = str(
-                        ticket_msg_soap.find('div', {'class': 'emailBodyHtml'})
-                    )
-                    log.debug(
-                        f'[spamscore][{ticket_mask}] found ticket_body from emailBodyHtml: len({len(ticket_body)})'
-                    )
-                elif ticket_msg_html.find('emailbody') >= 0:
-                    ticket_body = str(
-                        ticket_msg_soap.find('pre', {'class': 'emailbody'})
-                    )
-                    # for headers new line
-                    ticket_body = f'\n{ticket_body}'
-                    log.debug(
-                        f'[spamscore][{ticket_mask}] found ticket_body from emailbody: len({len(ticket_body)})'
-                    )
-                else:
-                    # not found body, pass
-                    raise Exception('not found ticket_body')
-
             ticket_body_hash = xxh128_hexdigest(ticket_body)
             log.debug(
-                f'[spamscore][{ticket_mask}] found ticket_body_hash: {ticket_body_hash}'
+                '[spamscore][%s] found ticket_body_hash: %s',
+                ticket_mask,
+                ticket_body_hash,
             )
 
             # Check spamscore_list
-            # TODO: regex
-            for data in spamscore_list:
-                if (
-                    ticket_email.find(str(data.email)) >= 0
-                    or ticket_subject.find(str(data.subject)) >= 0
-                    or ticket_body.find(str(data.body)) >= 0
-                    or ticket_body_hash == data.body_hash
-                ):
-                    log.debug(
-                        f'[spamscore][{ticket_mask}] found ticket in spamscore_list'
-                    )
-
-                    email_pass = False
-                    subject_pass = False
-                    body_pass = False
-                    body_hash_pass = False
-
-                    # Check email
-                    if data.email is None:
-                        # pass
-                        email_pass = True
-                    else:
-                        if ticket_email.find(data.email) >= 0:
-                            # pass
-                            log.debug(
-                                f'[spamscore][{ticket_mask}][spamlist] occurrence found email:{ticket_email} - {data.email}'
-                            )
-                            email_pass = True
-
-                    # Check subject
-                    if data.subject is None:
-                        # pass
-                        subject_pass = True
-                    else:
-                        if ticket_subject.find(data.subject) >= 0:
-                            # pass
-                            log.debug(
-                                f'[spamscore][{ticket_mask}][spamlist] occurrence found subject:{ticket_subject} - {data.subject}'
-                            )
-                            subject_pass = True
-
-                    # Check body
-                    if data.body is None:
-                        # pass
-                        body_pass = True
-                    else:
-                        if ticket_body.find(data.body) >= 0:
-                            # pass
-                            log.debug(
-                                f'[spamscore][{ticket_mask}][spamlist] occurrence found body: ... - {data.body}'
-                            )
-                            body_pass = True
-
-                    # check body_hash
-                    if data.body_hash is None:
-                        # pass
-                        body_hash_pass = True
-                    else:
-                        if ticket_body_hash == data.body_hash:
-                            # pass
-                            log.debug(
-                                f'[spamscore][{ticket_mask}][spamlist] occurrence found body_hash: {ticket_body_hash} - {data.body_hash}'
-                            )
-                            body_hash_pass = True
-
-                    if (
-                        email_pass is True
-                        and subject_pass is True
-                        and body_pass is True
-                        and body_hash_pass is True
-                    ):
-                        log.debug(
-                            f'[spamscore][{ticket_mask}] found ticket in spamscore_list, score:{data.score} comment:{data.comment}'
-                        )
-                        score += data.score
-
-                        # dont need another check
-                        break
+            rule = spamscore_list.match(
+                ticket_email, ticket_subject, ticket_body, ticket_body_hash
+            )
+            if rule is not None:
+                log.debug(
+                    '[spamscore][%s] found ticket in spamscore_list, score:%s comment:%s',
+                    ticket_mask,
+                    rule.score,
+                    rule.comment,
+                )
+                score += rule.score
 
             # Cerb score
             cerb_spam_score = re.findall(
@@ -390,7 +688,7 @@ class Cerb(BaseClass):
             if len(cerb_spam_score) > 0:
                 cerb_spam_score = float(cerb_spam_score[0])
                 log.debug(
-                    f'[spamscore][{ticket_mask}] cerb spam_score: {cerb_spam_score}'
+                    '[spamscore][%s] cerb spam_score: %s', ticket_mask, cerb_spam_score
                 )
                 if cerb_spam_score == 99.99:
                     score += 1
@@ -398,90 +696,179 @@ class Cerb(BaseClass):
                     score += 0.5
 
             # rspamd score
-            if os.getenv('ENABLE_RSPAMD') == '1':
+            if self.config.cerb.rspamd:
                 # Remove local smtp_relay header for better check (spf)
-                relays = re.findall(
-                    r'^Received:.*?\n(?=\n|\S+?:)',
-                    ticket_headers,
-                    flags=re.MULTILINE | re.DOTALL,
+                header_fields = split_headers(
+                    ticket_headers, relay_matcher(self.config.cerb.smtp_relays)
+                )
+                log.debug(
+                    '[spamscore][%s] header fields without local relays: %s',
+                    ticket_mask,
+                    len(header_fields),
                 )
-                for relay in relays:
-                    for cerb_relay in os.getenv('CERB_SMTP_RELAY').split(','):
-                        if relay.split('\n')[0].find(cerb_relay) >= 0:
-                            ticket_headers = ticket_headers.replace(relay, '')
-                            log.debug(
-                                f'[spamscore][{ticket_mask}] remove smtp_relay from headers {cerb_relay}'
-                            )
-
-                ticket_eml = f'{ticket_headers}{ticket_body}'
 
                 try:
-                    rspamd_score = requests.post(
-                        os.getenv('RSPAMD_API_URL'), data=ticket_eml
-                    ).json()
-                    log.debug(f'[spamscore][{ticket_mask}] rspamd resp: {rspamd_score}')
+                    rspamd_url = self.config.cerb.rspamd_url
+                    with self._step_timer('rspamd'):
+                        # headers joined, the body sent as is after them
+                        rspamd_score = self.rspamd.check(
+                            rspamd_url,
+                            [''.join(header_fields), ticket_body],
+                            cache_key(ticket_body_hash, header_fields),
+                        )
+                    log.debug(
+                        '[spamscore][%s] rspamd resp: %s', ticket_mask, rspamd_score
+                    )
                     rspamd_score = rspamd_score['score']
                     score += rspamd_score
                     log.debug(
-                        f'[spamscore][{ticket_mask}] rspamd score: {rspamd_score}'
+                        '[spamscore][%s] rspamd score: %s', ticket_mask, rspamd_score
                     )
                 except Exception as e:
-                    log.error(f'[spamscore][{ticket_mask}] rspamd score error: {e}')
+                    log.error('[spamscore][%s] rspamd score error: %s', ticket_mask, e)
 
         except Exception as e:
-            log.error(f'[spamscore][{ticket_mask}] error: {e}')
+            log.error('[spamscore][%s] error: %s', ticket_mask, e)
             return 0
 
         return score
 
+    #
+    # Ticket body, original message or conversation node
+    #
+    def _ticket_body(
+        self, ticket_mask: str, ticket_msg_html: str, ticket_msg_bodies: dict
+    ) -> str:
+        ticket_body_url = re.findall(
+            r'(/index.php/files/(\d+)/original_message.html)', ticket_msg_html
+        )
+        # from original_message.html
+        if len(ticket_body_url) > 0:
+            ticket_body_path, ticket_file_id = ticket_body_url[0]
+            ticket_body = self._req_artifact(
+                f'file:{ticket_file_id}', f'{self.SYSTEM_URL}{ticket_body_path}', 'body'
+            )
+            log.debug(
+                '[spamscore][%s] found ticket_body from original_message: len(%s)',
+                ticket_mask,
+                len(ticket_body),
+            )
+        elif ticket_msg_html.find('emailBodyHtml') >= 0:
+            ticket_body = str(ticket_msg_bodies.get('emailBodyHtml'))
+            log.debug(
+                '[spamscore][%s] found ticket_body from emailBodyHtml: len(%s)',
+                ticket_mask,
+                len(ticket_body),
+            )
+        elif ticket_msg_html.find('emailbody') >= 0:
+            ticket_body = str(ticket_msg_bodies.get('emailbody'))
+            # for headers new line
+            ticket_body = f'\n{ticket_body}'
+            log.debug(
+                '[spamscore][%s] found ticket_body from emailbody: len(%s)',
+                ticket_mask,
+                len(ticket_body),
+            )
+        else:
+            # not found body, pass
+            raise Exception('not found ticket_body')
+
+        return ticket_body
+
+    def _step_timer(self, step: str):
+        return metrics.timer(
+            'stage_seconds', system=self.SYSTEM_NAME, stage='spamscore', target=step
+        )
+
+    #
+    # Conversation url
+    #
+    def _conversation_url(self, ticket_id: int) -> str:
+        return f'{self.SYSTEM_URL}/ajax.php?c=display&a=showConversation&point=cerberusweb.profiles.ticket&ticket_id={ticket_id}&expand_all=1'
+
     #
     # Close ticket
     #
     def close_ticket(self, ticket_id: int, mark_spam: bool = False) -> None:
-        self._req_post(
-            url=f'{self.SYSTEM_URL}/index.php/',
-            data={
-                'c': 'display',
-                'a': 'updateProperties',
-                'id': ticket_id,
-                'status_id': 2 if mark_spam is False else 0,
-                'spam': 0 if mark_spam is False else 1,
-            },
+        with metrics.timer('stage_seconds', system=self.SYSTEM_NAME, stage='autoclose'):
+            self._req_post(
+                url=f'{self.SYSTEM_URL}/index.php/',
+                data={
+                    'c': 'display',
+                    'a': 'updateProperties',
+                    'id': ticket_id,
+                    'status_id': 2 if mark_spam is False else 0,
+                    'spam': 0 if mark_spam is False else 1,
+                },
+                target='updateProperties',
+            )
+
+    #
+    # Get request, immutable response cached by key
+    #
+    def _req_artifact(self, key: str, url: str, target: str = 'other') -> str:
+        return self.artifacts.get_or_fetch(
+            key, partial(self._req_get, url, target=target)
         )
 
     #
     # Get request
     #
-    def _req_get(self, url: str) -> str:
-        log.debug(f'get request: {url}')
-        resp = requests.get(
-            url=url,
-            headers={
-                'cookie': f'Devblocks={self.AUTH_TOKEN}',
-                'user-agent': self.USER_AGENT,
-            },
-        )
+    def _req_get(self, url: str, target: str = 'other') -> str:
+        log.debug('get request: %s', url)
+        # failing endpoint is skipped until its probe passes
+        with (
+            self.endpoint_breaker(target),
+            metrics.timer(
+                'stage_seconds', system=self.SYSTEM_NAME, stage='http', target=target
+            ),
+        ):
+            resp = get_session(self.SYSTEM_URL).get(
+                url=url,
+                headers={
+                    'cookie': f'Devblocks={self.AUTH_TOKEN}',
+                    'user-agent': self.USER_AGENT,
+                },
+            )
 
-        if resp.status_code != 200:
-            raise Exception(f'wrong status_code from response {url}')
+            if resp.status_code != 200:
+                raise Exception(f'wrong status_code from response {url}')
 
         return resp.text
 
     #
     # Post request
     #
-    def _req_post(self, url: str, data: list) -> str:
-        log.debug(f'post request: {url} with data: {data}')
-        resp = requests.post(
-            url=url,
-            data=data,
-            headers={
-                'cookie': f'Devblocks={self.AUTH_TOKEN}',
-                'user-agent': self.USER_AGENT,
-            },
-        )
+    def _req_post(self, url: str, data: list, target: str = 'other') -> str:
+        log.debug('post request: %s with data: %s', url, data)
+        # failing endpoint is skipped until its probe passes
+        with (
+            self.endpoint_breaker(target),
+            metrics.timer(
+                'stage_seconds', system=self.SYSTEM_NAME, stage='http', target=target
+            ),
+        ):
+            resp = get_session(self.SYSTEM_URL).post(
+                url=url,
+                data=data,
+                headers={
+                    'cookie': f'Devblocks={self.AUTH_TOKEN}',
+                    'user-agent': self.USER_AGENT,
+                },
+            )
 
-        if resp.status_code != 200:
-            raise Exception(f'wrong status_code from response {url}')
+            if resp.status_code != 200:
+                raise Exception(f'wrong status_code from response {url}')
 
         return resp.text
+
+
+def _is_sorted(rows: list[dict]) -> bool:
+    return all(a['updated_at'] >= b['updated_at'] for a, b in pairwise(rows))
+
+
+# full page and its oldest row not below the mark, no mark on first poll
+def _has_more(rows: list[dict], page_size: int, high_water: datetime | None) -> bool:
+    if not rows or len(rows) < page_size:
+        return False
+    return high_water is None or rows[-1]['updated_at'] >= high_water
@@ -0,0 +1,309 @@
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+#
+# Streaming extractors for the few Cerberus nodes we read, no soup tree per page
+#
+
+# mask from ticket url
+MASK_RE = re.compile(r'/profiles/ticket/(.*)/conversation')
+# worklist footer, Showing 1-10 of 123
+TOTAL_RE = re.compile(r'Showing\s+\d+\s*-\s*\d+\s+of\s+(\d+)')
+
+
+class _StopParsing(Exception):
+    pass
+
+
+def _has_class(attrs: dict, name: str) -> bool:
+    return name in (attrs.get('class') or '').split()
+
+
+class _Extractor(HTMLParser):
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+
+    def run(self):
+        try:
+            self.feed(self.html)
+            self.close()
+        except _StopParsing:
+            pass
+        return self
+
+    # offset in self.html of the tag being handled
+    def tag_offset(self) -> int:
+        line, col = self.getpos()
+        if line == 1:
+            return col
+        return _nth_line_start(self.html, line) + col
+
+
+def _nth_line_start(html: str, line: int) -> int:
+    pos = -1
+    for _ in range(line - 1):
+        pos = html.find('\n', pos + 1)
+    return pos + 1
+
+
+#
+# Worklist: bucket name and ticket rows
+#
+class _WorklistExtractor(_Extractor):
+    TAGS = frozenset(('span', 'table', 'tbody', 'input', 'a', 'td'))
+
+    def __init__(self, html: str):
+        super().__init__(html)
+        self.bucket_name = None
+        self.rows = []
+
+        self._title = None  # span.title text parts while inside
+        self._span_depth = 0
+        self._table_seen = False
+        self._table_depth = 0  # inside table.worklistBody
+        self._row = None  # current tbody record
+        self._text = None  # (key, parts) of the <a> being read
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.TAGS:
+            return
+        attrs = dict(attrs)
+
+        if tag == 'span':
+            if self._title is not None:
+                self._span_depth += 1
+            elif self.bucket_name is None and _has_class(attrs, 'title'):
+                self._title = []
+                self._span_depth = 1
+
+        elif tag == 'table':
+            if self._table_depth:
+                self._table_depth += 1
+            elif not self._table_seen and _has_class(attrs, 'worklistBody'):
+                self._table_seen = True
+                self._table_depth = 1
+
+        elif self._table_depth == 1 and tag == 'tbody':
+            self._row = {}
+
+        elif self._row is not None:
+            row = self._row
+            if tag == 'input':
+                if attrs.get('name') == 'ticket_id[]' and 'local_id' not in row:
+                    row['local_id'] = attrs.get('value')
+            elif tag == 'a':
+                if _has_class(attrs, 'subject') and 'subject' not in row:
+                    row['href'] = attrs.get('href')
+                    self._text = ('subject', [])
+                elif (
+                    attrs.get('data-context') == 'cerberusweb.contexts.address'
+                    and 'user' not in row
+                ):
+                    self._text = ('user', [])
+            elif tag == 'td':
+                if (
+                    attrs.get('data-column') == 't_updated_date'
+                    and 'updated_at' not in row
+                ):
+                    row['updated_at'] = attrs.get('data-timestamp')
+
+    def handle_endtag(self, tag):
+        if tag == 'span' and self._title is not None:
+            self._span_depth -= 1
+            if self._span_depth == 0:
+                self.bucket_name = ''.join(self._title)
+                self._title = None
+
+        elif tag == 'table' and self._table_depth:
+            self._table_depth -= 1
+
+        elif tag == 'tbody' and self._row is not None and self._table_depth == 1:
+            self.rows.append(self._row)
+            self._row = None
+
+        elif tag == 'a' and self._text is not None:
+            key, parts = self._text
+            self._row[key] = ''.join(parts)
+            self._text = None
+
+    def handle_data(self, data):
+        if self._title is not None:
+            self._title.append(data)
+        if self._text is not None:
+            self._text[1].append(data)
+
+
+def parse_worklist(html: str) -> tuple[str | None, list[dict]]:
+    """Bucket name and raw rows: local_id, href, subject, user, updated_at (timestamp str)."""
+    extractor = _WorklistExtractor(html).run()
+    return extractor.bucket_name, extractor.rows
+
+
+def parse_worklist_total(html: str) -> int | None:
+    """Rows in the whole worklist, from the paging footer."""
+    match = TOTAL_RE.search(html)
+    return int(match.group(1)) if match else None
+
+
+#
+# Ticket profile: messages/comments counters
+#
+class _CountersExtractor(_Extractor):
+    CONTEXTS = {
+        'cerberusweb.contexts.message': 'messages',
+        'cerberusweb.contexts.comment': 'comments',
+    }
+
+    def __init__(self, html: str):
+        super().__init__(html)
+        self.counters = {}
+        self._button = None  # counter name inside a trigger button
+        self._text = None  # first div text parts
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'button' and self._button is None:
+            attrs = dict(attrs)
+            name = self.CONTEXTS.get(attrs.get('data-context'))
+            if (
+                name
+                and name not in self.counters
+                and _has_class(attrs, 'cerb-search-trigger')
+            ):
+                self._button = name
+        elif tag == 'div' and self._button is not None and self._text is None:
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'div' and self._text is not None:
+            self.counters[self._button] = ''.join(self._text)
+            self._button = None
+            self._text = None
+            if len(self.counters) == len(self.CONTEXTS):
+                raise _StopParsing()
+        elif tag == 'button':
+            self._button = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def parse_counters(html: str) -> tuple[int, int]:
+    """Messages and comments count of the ticket profile page."""
+    counters = _CountersExtractor(html).run().counters
+    return int(counters['messages']), int(counters['comments'])
+
+
+#
+# Headers popup: textarea
+#
+class _TextareaExtractor(_Extractor):
+    def __init__(self, html: str):
+        super().__init__(html)
+        self.text = None
+        self._parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'textarea' and self._parts is None:
+            self._parts = []
+
+    def handle_endtag(self, tag):
+        if tag == 'textarea' and self._parts is not None:
+            self.text = ''.join(self._parts)
+            raise _StopParsing()
+
+    def handle_data(self, data):
+        if self._parts is not None:
+            self._parts.append(data)
+
+    def close(self):
+        super().close()
+        # unclosed textarea runs to the end of page
+        if self.text is None and self._parts is not None:
+            self.text = ''.join(self._parts)
+
+
+def parse_textarea(html: str) -> str | None:
+    """Text of the first textarea."""
+    return _TextareaExtractor(html).run().text
+
+
+#
+# Conversation: sender address and message body nodes
+#
+class _ConversationExtractor(_Extractor):
+    BODIES = (('div', 'emailBodyHtml'), ('pre', 'emailbody'))
+
+    def __init__(self, html: str):
+        super().__init__(html)
+        self.email = None
+        self.bodies = {}  # class: raw html of the first node
+        self._email = None
+        self._body = None  # [tag, class, start offset, depth]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if (
+            tag == 'a'
+            and self.email is None
+            and self._email is None
+            and attrs.get('data-context') == 'cerberusweb.contexts.address'
+        ):
+            self._email = []
+
+        if self._body is not None:
+            if tag == self._body[0]:
+                self._body[3] += 1
+            return
+
+        for body_tag, body_class in self.BODIES:
+            if (
+                tag == body_tag
+                and body_class not in self.bodies
+                and _has_class(attrs, body_class)
+            ):
+                self._body = [tag, body_class, self.tag_offset(), 1]
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._email is not None:
+            self.email = ''.join(self._email)
+            self._email = None
+
+        if self._body is not None and tag == self._body[0]:
+            self._body[3] -= 1
+            if self._body[3] == 0:
+                end = self.html.find('>', self.tag_offset()) + 1
+                self.bodies[self._body[1]] = self.html[self._body[2] : end]
+                self._body = None
+
+    def handle_data(self, data):
+        if self._email is not None:
+            self._email.append(data)
+
+    def close(self):
+        super().close()
+        # unclosed body node runs to the end of page
+        if self._body is not None:
+            self.bodies[self._body[1]] = self.html[self._body[2] :]
+
+
+def parse_conversation(html: str) -> tuple[str | None, dict[str, str]]:
+    """Sender address text and {'emailBodyHtml'|'emailbody': serialized node}.
+
+    Nodes are serialized exactly as str() of the BeautifulSoup tag, body_hash
+    in ticket_spamscore_list depends on it, only the node itself is souped.
+    """
+    extractor = _ConversationExtractor(html).run()
+
+    bodies = {}
+    for body_tag, body_class in _ConversationExtractor.BODIES:
+        if body_class in extractor.bodies:
+            node = BeautifulSoup(extractor.bodies[body_class], 'html.parser').find(
+                body_tag
+            )
+            bodies[body_class] = str(node)
+
+    return extractor.email, bodies
@@ -1,104 +1,226 @@
 import datetime
 import logging
 import json
+from collections.abc import Iterator
+from contextlib import closing
 
-import requests
-
+from requests import Response
 from sqlalchemy.orm import session
+from app.config import Config, SystemConfig
+from app.http_client import get_session
+from app.json_stream import iter_json_list
+from app.metrics import metrics
 from app.models import Ticket as TicketModel
+from app.ticket_batch import TicketBatch
 from app.tsystem.base import BaseClass
 
 log = logging.getLogger('tsystem.guru')
 
+# response read size, bytes
+CHUNK_SIZE = 64 * 1024
+
 
 class Guru(BaseClass):
     SYSTEM_NAME = 'Guru'
     SYSTEM_URL = 'https://ihc.guru'
     QUERY_DATA = dict
 
-    def __init__(self, token: str, query_data: dict):
-        self.AUTH_TOKEN = token
-        self.QUERY_DATA = query_data
+    def __init__(self, config: Config, system: SystemConfig):
+        super().__init__(config, system)
+        self.QUERY_DATA = {'query': system.query}
+
+    #
+    # Fetch jobs
+    #
+    def fetch_jobs(self) -> dict:
+        return {'search': self.fetch_search}
+
+    #
+    # Fetch search, newest activity first down to the high-water mark
+    #
+    def fetch_search(self) -> dict:
+        high_water = self.high_water.get('search')
+        rows = []
+        masks = set()
+
+        for page in range(1, self.config.guru.max_pages + 1):
+            items = 0
+            added = 0
+            older = False
+
+            # request timed as http, reading and decoding the body as parse
+            resp = self._search(page)
+            with (
+                metrics.timer(
+                    'stage_seconds',
+                    system=self.SYSTEM_NAME,
+                    stage='parse',
+                    target='search',
+                ),
+                closing(self._search_tickets(resp)) as tickets_data,
+            ):
+                for ticket_data in tickets_data:
+                    items += 1
+                    row = self._search_row(ticket_data['ticket'])
+                    # the rest was read on the last cycles, dont download it
+                    if high_water is not None and row['updated_at'] < high_water:
+                        older = True
+                        break
+                    # rows shift between pages while they are fetched
+                    if row['mask'] not in masks:
+                        masks.add(row['mask'])
+                        rows.append(row)
+                        added += 1
+
+            # last page, or page size ignored and everything is here
+            if older or items != self.config.guru.page_size:
+                break
+            # a full page of known tickets, page is probably ignored
+            if not added:
+                log.warning('search page %d added no tickets, stop paging', page)
+                break
+
+        # rows hashed on id (url) + lastActivity (updated_at) and the rest
+        return {'hash': None, 'rows': rows}
+
+    def _search_row(self, ticket: dict) -> dict:
+        ticket_id = int(ticket['id'])
+        return {
+            'mask': ticket['mask'],
+            'group': ticket['panelPrefix'],
+            'subject': ticket['subject'],
+            'url': f'{self.SYSTEM_URL}/#/support/chat/{ticket["panelPrefix"]}/{ticket_id}',
+            'user': ticket['username'],
+            'updated_at': datetime.datetime.strptime(
+                ticket['lastActivity'], '%Y-%m-%d %H:%M:%S'
+            ),
+        }
 
     #
     # Parse tickets
     #
-    def process_tickets(self, db_session: session) -> list[TicketModel]:
+    def process_tickets(
+        self,
+        db_session: session,
+        results: dict | None = None,
+        batch: TicketBatch | None = None,
+    ) -> list[TicketModel]:
         tickets = []
 
-        data = self._req_post(
-            url=f'{self.SYSTEM_URL}/ticket/search',
-            data=json.dumps(self.QUERY_DATA),
+        # standalone call, write at the end
+        if results is None:
+            results = {key: job() for key, job in self.fetch_jobs().items()}
+        if batch is None:
+            return self.write_batch(db_session, results)
+
+        # unchanged rows are dropped
+        changed = {
+            key: self.changed_rows(key, page['rows']) for key, page in results.items()
+        }
+
+        # check in db by mask, whole batch at once
+        known_tickets = self.lookup_tickets(
+            db_session, {row['mask'] for rows in changed.values() for row in rows}
         )
 
-        if 'list' not in data:
-            raise Exception('guru: not found tickets list in response, Wrong token?')
-
-        for ticket_data in data['list']:
-            ticket_id = int(ticket_data['ticket']['id'])
-            ticket_mask = ticket_data['ticket']['mask']
-            ticket_subject = ticket_data['ticket']['subject']
-            ticket_user = ticket_data['ticket']['username']
-            ticket_group = ticket_data['ticket']['panelPrefix']
-            ticket_url = f'{self.SYSTEM_URL}/#/support/chat/{ticket_data["ticket"]["panelPrefix"]}/{ticket_id}'
-            ticket_updated_at = datetime.datetime.strptime(
-                ticket_data['ticket']['lastActivity'], '%Y-%m-%d %H:%M:%S'
+        for rows in changed.values():
+            metrics.inc(
+                'tickets_total', len(rows), system=self.SYSTEM_NAME, state='seen'
             )
+            for row in rows:
+                ticket_mask = row['mask']
+                ticket_updated_at = row['updated_at']
 
-            ticket = db_session.query(TicketModel).filter_by(mask=ticket_mask).first()
+                ticket = known_tickets.get(ticket_mask)
 
-            if ticket is not None:
-                log.debug('found mask in Database')
-                if ticket.updated_at == ticket_updated_at:
-                    log.debug('nothing new, skip')
-                else:
-                    # TODO: filter lastActivity
-                    if (ticket_updated_at - ticket.updated_at).total_seconds() < 61:
-                        log.debug('dont double notify < 1min, update time and skip')
-                        ticket.updated_at = ticket_updated_at
-                        db_session.flush()
+                if ticket is not None:
+                    log.debug('found mask in Database')
+                    if ticket.updated_at == ticket_updated_at:
+                        log.debug('nothing new, skip')
                     else:
-                        log.debug('updated ticket, add to rval')
-                        ticket.updated_at = ticket_updated_at
-                        db_session.flush()
-                        tickets.append(ticket)
-            else:
-                log.debug('found new ticket')
-                ticket = TicketModel(
-                    system_name=self.SYSTEM_NAME,
-                    mask=ticket_mask,
-                    group=ticket_group,
-                    subject=ticket_subject,
-                    url=ticket_url,
-                    user=ticket_user,
-                    updated_at=ticket_updated_at,
-                    # System clients only
-                    spam_score=-99,
-                )
-                log.debug('add ticket to database')
-                db_session.add(ticket)
-                log.debug('add ticket to rval')
-                tickets.append(ticket)
-
-        return tickets
+                        # TODO: filter lastActivity
+                        if (ticket_updated_at - ticket.updated_at).total_seconds() < 61:
+                            log.debug('dont double notify < 1min, update time and skip')
+                            batch.update(ticket, ticket_updated_at)
+                        else:
+                            log.debug('updated ticket, add to rval')
+                            batch.update(ticket, ticket_updated_at)
+                            metrics.inc(
+                                'tickets_total',
+                                system=self.SYSTEM_NAME,
+                                state='updated',
+                            )
+                            tickets.append(ticket)
+                elif self.is_archived(ticket_updated_at):
+                    log.debug('archived ticket, skip')
+                else:
+                    log.debug('found new ticket')
+                    ticket = TicketModel(
+                        system_name=self.SYSTEM_NAME,
+                        # System clients only
+                        spam_score=-99,
+                        **row,
+                    )
+                    log.debug('add ticket to database')
+                    batch.add(ticket)
+                    metrics.inc('tickets_total', system=self.SYSTEM_NAME, state='new')
+                    known_tickets[ticket_mask] = ticket
+                    log.debug('add ticket to rval')
+                    tickets.append(ticket)
+
+        for key, page in results.items():
+            self.stage_hashes(key, page)
+
+        # sharded workers, notify only the changes claimed here
+        return self.claim_tickets(tickets)
 
     #
-    # Post request
+    # Search page request, the body is streamed by _search_tickets
     #
-    def _req_post(self, url: str, data: list) -> dict:
-        log.debug(f'post request: {url} with data: {data}')
-        resp = requests.post(
-            url=url,
-            data=data,
-            headers={
-                'cookie': f'JSESSIONID={self.AUTH_TOKEN}',
-                'user-agent': self.USER_AGENT,
-                'Origin': 'https://ihc.guru',
-                'Referer': 'https://ihc.guru/',
-            },
+    def _search(self, page: int) -> Response:
+        url = f'{self.SYSTEM_URL}/ticket/search'
+        data = json.dumps(
+            {
+                **self.QUERY_DATA,
+                # paging down to the high-water mark needs this order
+                'sort': {'field': 'byactivity', 'order': -1},
+                'page': page,
+                'limit': self.config.guru.page_size,
+            }
         )
+        log.debug('post request: %s with data: %s', url, data)
+
+        # failing token/endpoint is skipped until its probe passes
+        with (
+            self.endpoint_breaker('search'),
+            metrics.timer(
+                'stage_seconds', system=self.SYSTEM_NAME, stage='http', target='search'
+            ),
+        ):
+            resp = get_session(self.SYSTEM_URL).post(
+                url=url,
+                data=data,
+                headers={
+                    'cookie': f'JSESSIONID={self.AUTH_TOKEN}',
+                    'user-agent': self.USER_AGENT,
+                    'Origin': 'https://ihc.guru',
+                    'Referer': 'https://ihc.guru/',
+                },
+                stream=True,
+            )
 
-        if resp.status_code != 200:
-            raise Exception(f'wrong status_code from response {url}')
+            if resp.status_code != 200:
+                resp.close()
+                raise Exception(f'wrong status_code from response {url}')
 
-        return resp.json()
+        return resp
+
+    # tickets decoded as the response is read
+    def _search_tickets(self, resp: Response) -> Iterator[dict]:
+        with resp:
+            try:
+                yield from iter_json_list(resp.iter_content(CHUNK_SIZE), 'list')
+            except KeyError:
+                raise Exception(
+                    'guru: not found tickets list in response, Wrong token?'
+                )
@@ -0,0 +1,300 @@
+"""Offline benchmark of the polling cycle.
+
+    python -m bench --tickets 10,200,2000 --rules 10,10000 --repeat 20
+
+Runs every scenario against the local fake server (bench.server) and a
+throwaway SQLite database, then prints latency percentiles and the peak of
+traced allocations of one extra run per scenario.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent import futures
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+# app.db builds the engine on import
+_tmpdir = tempfile.TemporaryDirectory(prefix='ticketsync-bench-')
+os.environ['DATABASE_URL'] = f'sqlite:///{_tmpdir.name}/bench.sqlite'
+os.environ['ARTIFACT_CACHE_PATH'] = f'{_tmpdir.name}/artifacts.sqlite'
+
+from app.config import Config, SystemConfig, TelegramConfig  # noqa: E402
+from app.db import Base, engine, get_db  # noqa: E402
+from app.mask_filter import mask_filter  # noqa: E402
+from app.models import SpamscoreList as SpamscoreListModel  # noqa: E402
+from app.models import Ticket as TicketModel  # noqa: E402
+from app.notification.telegram import Telegram  # noqa: E402
+from app.poller import Poller  # noqa: E402
+from app.scheduler import Scheduler  # noqa: E402
+from app.tsystem.cerb import Cerb  # noqa: E402
+from app.tsystem.guru import Guru  # noqa: E402
+from bench import fixtures  # noqa: E402
+from bench.server import FakeServer  # noqa: E402
+
+BUCKETS = {600: 'Service', 601: 'Support'}
+
+
+#
+# Scenario setup
+#
+def reset_db() -> None:
+    with get_db() as db_session:
+        db_session.query(TicketModel).delete()
+        db_session.query(SpamscoreListModel).delete()
+    # sqlite reuses ids of the deleted rows
+    mask_filter.reset()
+
+
+def load_rules(count: int) -> None:
+    with get_db() as db_session:
+        db_session.query(SpamscoreListModel).delete()
+        db_session.bulk_insert_mappings(
+            SpamscoreListModel, fixtures.spamscore_rules(count)
+        )
+
+
+def fill_buckets(server: FakeServer, tickets: int) -> None:
+    # created an hour ago, past the new ticket 1min wait
+    updated_at = int(time.time()) - 3600
+    server.buckets = {bucket_id: (name, []) for bucket_id, name in BUCKETS.items()}
+    for index in range(tickets):
+        bucket_id = list(BUCKETS)[index % len(BUCKETS)]
+        server.buckets[bucket_id][1].append((index, updated_at - index))
+
+
+def touch_one_row(server: FakeServer) -> None:
+    # one updated ticket, page and row change
+    name, rows = server.buckets[601]
+    if rows:
+        index, updated_at = rows[0]
+        rows[0] = (index, updated_at + 120)
+
+
+# scenario env is set before the systems are built
+def bench_config() -> Config:
+    return Config.from_env(os.environ)
+
+
+def new_cerb(server: FakeServer) -> Cerb:
+    cerb = Cerb(
+        bench_config(), SystemConfig(kind='cerb', token='bench', buckets=tuple(BUCKETS))
+    )
+    cerb.SYSTEM_URL = server.url
+    return cerb
+
+
+def new_guru(server: FakeServer) -> Guru:
+    guru = Guru(bench_config(), SystemConfig(kind='guru', token='bench', query='bench'))
+    guru.SYSTEM_URL = server.url
+    return guru
+
+
+#
+# Scenarios, each returns (setup, run) callables
+#
+def cerb_cold(server: FakeServer, tickets: int, **_):
+    os.environ['ENABLE_SPAM_SCORE'] = '0'
+    fill_buckets(server, tickets)
+    cerb = new_cerb(server)
+
+    def setup():
+        reset_db()
+        cerb.seen_hashes = {}
+        cerb.high_water = {}
+
+    def run():
+        with get_db() as db_session:
+            cerb.process_tickets(db_session)
+        cerb.commit_hashes()
+
+    return setup, run
+
+
+def cerb_steady(server: FakeServer, tickets: int, **_):
+    os.environ['ENABLE_SPAM_SCORE'] = '0'
+    fill_buckets(server, tickets)
+    cerb = new_cerb(server)
+    reset_db()
+    with get_db() as db_session:
+        cerb.process_tickets(db_session)
+    cerb.commit_hashes()
+
+    def run():
+        with get_db() as db_session:
+            cerb.process_tickets(db_session)
+        cerb.commit_hashes()
+
+    return lambda: touch_one_row(server), run
+
+
+def guru_cold(server: FakeServer, tickets: int, **_):
+    now = datetime.now() - timedelta(hours=1)
+    server.guru_rows = [(i, now - timedelta(seconds=i)) for i in range(tickets)]
+    guru = new_guru(server)
+
+    def setup():
+        reset_db()
+        guru.seen_hashes = {}
+        guru.high_water = {}
+
+    def run():
+        with get_db() as db_session:
+            guru.process_tickets(db_session)
+        guru.commit_hashes()
+
+    return setup, run
+
+
+def spamscore(server: FakeServer, rules: int, **_):
+    os.environ['ENABLE_RSPAMD'] = '1'
+    os.environ['RSPAMD_API_URL'] = f'{server.url}/rspamd/checkv2'
+    os.environ['CERB_SMTP_RELAY'] = 'relay.local'
+    cerb = new_cerb(server)
+    reset_db()
+    load_rules(rules)
+    with get_db() as db_session:
+        matcher = cerb.spamscore_list.get(db_session)
+
+    def run():
+        cerb.spamscore_ticket(fixtures.mask(7), matcher)
+
+    return None, run
+
+
+def cycle(server: FakeServer, tickets: int, rules: int, **_):
+    os.environ['ENABLE_SPAM_SCORE'] = '1'
+    os.environ['ENABLE_RSPAMD'] = '1'
+    os.environ['RSPAMD_API_URL'] = f'{server.url}/rspamd/checkv2'
+    os.environ['CERB_SMTP_RELAY'] = 'relay.local'
+    fill_buckets(server, tickets)
+    now = datetime.now() - timedelta(hours=1)
+    server.guru_rows = [(i, now - timedelta(seconds=i)) for i in range(tickets)]
+    load_rules(rules)
+
+    notification = Telegram(
+        TelegramConfig(token='bench', chat_id='1', rate_per_min=6000, burst=100)
+    )
+    notification.API_URL = server.url
+    ticket_systems = [new_cerb(server), new_guru(server)]
+    # every source due on every cycle
+    scheduler = Scheduler(
+        replace(
+            bench_config().poll, active=0, idle=0, offshift=0, backoff_max=0, jitter=0
+        )
+    )
+    poller = Poller(ticket_systems, scheduler=scheduler)
+
+    def setup():
+        with get_db() as db_session:
+            db_session.query(TicketModel).delete()
+        mask_filter.reset()
+        for ticket_system in ticket_systems:
+            ticket_system.seen_hashes = {}
+            ticket_system.high_water = {}
+
+    def run():
+        # main() loop until every started source and scoring is processed
+        started = False
+        while not started or poller.inflight or poller.pending_work():
+            with get_db() as db_session:
+                for ticket in poller.poll(db_session):
+                    notification.notify(ticket)
+            poller.commit_changes()
+            started = True
+            # every source is always due, poll again only once scores are in
+            futures.wait(poller.pending_work())
+            if poller.inflight:
+                poller.wait()
+
+    return setup, run
+
+
+SCENARIOS = {
+    'cerb.cold': (cerb_cold, 'tickets'),
+    'cerb.steady': (cerb_steady, 'tickets'),
+    'guru.cold': (guru_cold, 'tickets'),
+    'spamscore': (spamscore, 'rules'),
+    'cycle': (cycle, 'tickets'),
+}
+
+
+#
+# Measure
+#
+def measure(setup, run, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    # separate run, tracing slows everything down
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # one interpolation for every percentile, p50 <= p90 <= p99 on few runs
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'p50': percentiles[49],
+        'p90': percentiles[89],
+        'p99': percentiles[98],
+        'max': max(timings),
+        'peak_kib': peak / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__)
+    parser.add_argument('--tickets', default='10,200,2000')
+    parser.add_argument('--rules', default='10,10000')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0, help='seconds')
+    parser.add_argument('--only', default=','.join(SCENARIOS))
+    parser.add_argument(
+        '--parse-workers', type=int, default=0, help='CERB_PARSE_WORKERS'
+    )
+    args = parser.parse_args()
+
+    tickets = [int(x) for x in args.tickets.split(',')]
+    rules = [int(x) for x in args.rules.split(',')]
+
+    os.environ.setdefault('ENABLE_AUTOCLOSE', '0')
+    os.environ['CERB_PARSE_WORKERS'] = str(args.parse_workers)
+    Base.metadata.create_all(engine)
+
+    out = sys.stdout
+    out.write(
+        f'{"scenario":<14}{"tickets":>8}{"rules":>8}'
+        f'{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}{"peak KiB":>11}\n'
+    )
+
+    with FakeServer(latency=args.latency) as server:
+        for name in args.only.split(','):
+            scenario, scale = SCENARIOS[name]
+            for size in tickets if scale == 'tickets' else rules:
+                n_tickets = size if scale == 'tickets' else 1
+                n_rules = size if scale == 'rules' else rules[0]
+                setup, run = scenario(server, tickets=n_tickets, rules=n_rules)
+                result = measure(setup, run, args.repeat)
+                out.write(
+                    f'{name:<14}{n_tickets:>8}{n_rules:>8}'
+                    f'{result["p50"] * 1000:>10.1f}{result["p90"] * 1000:>10.1f}'
+                    f'{result["p99"] * 1000:>10.1f}{result["max"] * 1000:>10.1f}'
+                    f'{result["peak_kib"]:>11.0f}\n'
+                )
+                out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import json
+import random
+from datetime import datetime
+
+#
+# Cerberus/Guru/rspamd/Telegram responses, shaped like the recorded pages
+#
+
+BODY_WORDS = (
+    'hello support domain hosting invoice payment please help site mail '
+    'server error dns record ssl certificate renew account balance'
+).split()
+
+
+# worklist rows per page
+PAGE_SIZE = 100
+
+
+def mask(index: int) -> str:
+    return f'BN-{10000 + index:05d}-{100 + index % 900}'
+
+
+def worklist_row(index: int, updated_at: int) -> str:
+    return f'''<tbody>
+<tr class="tableRowBg">
+ <td data-column="*_selection" rowspan="2"><input type="checkbox" name="ticket_id[]" value="{index + 1}"></td>
+ <td colspan="5"><a href="/index.php/profiles/ticket/{mask(index)}/conversation" class="subject">Ticket subject number {index} &amp; co</a>
+  <button type="button" class="peek" data-context="cerberusweb.contexts.ticket" data-context-id="{index + 1}"><span class="glyphicons glyphicons-new-window-alt"></span></button></td>
+</tr>
+<tr class="tableRowAltBg">
+ <td data-column="t_first_wrote_address_id"><a href="javascript:;" class="cerb-peek-trigger" data-context="cerberusweb.contexts.address" data-context-id="{index + 1}">client{index}@example.com</a></td>
+ <td data-column="t_updated_date" data-timestamp="{updated_at}" title="{datetime.fromtimestamp(updated_at)}">1 hour ago</td>
+ <td data-column="t_group_id"><a href="javascript:;" class="cerb-peek-trigger" data-context="cerberusweb.contexts.group">Support</a></td>
+ <td data-column="t_bucket_id">Inbox</td>
+ <td data-column="t_importance"><div class="cerb-percentage"><div style="width:50%;"></div></div></td>
+</tr>
+</tbody>'''
+
+
+def worklist(
+    bucket_id: int,
+    bucket_name: str,
+    rows: list[tuple[int, int]],
+    page: int = 0,
+    total: int | None = None,
+) -> str:
+    """rows: [(ticket index, updated_at timestamp)] of the page"""
+    body = '\n'.join(worklist_row(index, updated_at) for index, updated_at in rows)
+    return f"""<div id="view_cust_{bucket_id}">
+<table cellpadding="0" cellspacing="0" border="0" class="worklist" width="100%">
+ <tr><td nowrap="nowrap"><span class="title">{bucket_name}</span>
+  <a href="javascript:;" title="Customize"><span class="glyphicons glyphicons-cogwheel"></span></a></td></tr>
+</table>
+<form id="viewForm_cust_{bucket_id}" name="viewForm_cust_{bucket_id}" action="#">
+<table cellpadding="1" cellspacing="0" border="0" width="100%" class="worklistBody">
+<thead><tr>
+ <th><input type="checkbox"></th><th data-column="t_subject">Subject</th>
+ <th data-column="t_updated_date">Updated</th><th data-column="t_group_id">Group</th>
+</tr></thead>
+{body}
+</table>
+<div class="footer">Showing {page * PAGE_SIZE + 1} - {page * PAGE_SIZE + len(rows)} of {len(rows) if total is None else total}</div>
+</form>
+</div>"""
+
+
+def profile(index: int) -> str:
+    return f"""<html><head><title>{mask(index)}</title></head><body>
+<div class="cerb-profile-layout">
+ <div class="cerb-properties-grid">
+  <div><label>Status:</label> open</div>
+  <div><label>Org:</label> <div style="color:rgb(175,175,175);">(none)</div></div>
+  <b>Spam Score:</b>
+	{random.choice(('0.01', '45.20', '99.99'))}%
+ </div>
+ <button type="button" class="cerb-search-trigger" data-context="cerberusweb.contexts.message" data-query="ticket.id:{index + 1}"><div class="badge-count">1</div> Messages</button>
+ <button type="button" class="cerb-search-trigger" data-context="cerberusweb.contexts.comment" data-query="on.ticket:(id:{index + 1})"><div class="badge-count">0</div> Comments</button>
+ <a href="javascript:;" data-href="ajax.php?c=display&a=showConversation&ticket_id={index + 1}">Conversation</a>
+</div>
+</body></html>"""
+
+
+def conversation(ticket_id: int) -> str:
+    return f'''<div id="conversation">
+<div class="block" id="message{ticket_id}">
+ <span class="tag">Sender:</span>
+ <a href="javascript:;" class="cerb-peek-trigger" data-context="cerberusweb.contexts.address" data-context-id="{ticket_id}">&lt;client{ticket_id - 1}@example.com&gt;</a><br>
+ <b>Subject:</b> Ticket subject number {ticket_id - 1}<br>
+ <a href="javascript:;" onclick="genericAjaxPopup('message_headers','c=profiles&a=handleSectionAction&section=ticket&action=showMessageFullHeadersPopup&id={ticket_id}');">Show full headers</a>
+ <a href="/index.php/files/{ticket_id}/original_message.html" target="_blank">original_message.html</a>
+ <div class="emailBodyHtml"><p>{' '.join(random.choices(BODY_WORDS, k=80))}</p></div>
+</div>
+</div>'''
+
+
+def headers_popup(msg_id: int) -> str:
+    return f"""<div id="popup">
+<textarea style="width:100%;height:400px;" readonly="readonly">
+Return-Path: &lt;client{msg_id - 1}@example.com&gt;
+Received: from relay.local (relay.local [10.0.0.1])
+	by mx.local (Postfix) with ESMTP id 4F1;
+	Mon, 1 Sep 2025 10:00:00 +0300
+Received: from mail.example.com (mail.example.com [192.0.2.10])
+	by relay.local (Postfix) with ESMTPS id 9A2;
+	Mon, 1 Sep 2025 10:00:00 +0300
+From: client{msg_id - 1}@example.com
+To: support@majordomo.ru
+Subject: Ticket subject number {msg_id - 1}
+Date: Mon, 1 Sep 2025 10:00:00 +0300
+Message-ID: &lt;{msg_id}@example.com&gt;
+Content-Type: text/html; charset=utf-8
+</textarea>
+</div>"""
+
+
+def original_message(msg_id: int, size: int = 20_000) -> str:
+    random.seed(msg_id)
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(BODY_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return f'\n<html><body><p>{" ".join(words)}</p></body></html>'
+
+
+def guru_list(rows: list[tuple[int, datetime]]) -> str:
+    """rows: [(ticket index, lastActivity)]"""
+    return json.dumps(
+        {
+            'list': [
+                {
+                    'ticket': {
+                        'id': 50000 + index,
+                        'mask': f'HG-{60000 + index}-{index % 999}',
+                        'subject': f'Guru ticket {index}',
+                        'username': f'user{index}',
+                        'panelPrefix': 'mjd',
+                        'lastActivity': last_activity.strftime('%Y-%m-%d %H:%M:%S'),
+                    }
+                }
+                for index, last_activity in rows
+            ],
+        }
+    )
+
+
+def rspamd_result() -> str:
+    return json.dumps({'action': 'no action', 'score': 1.5, 'required_score': 15})
+
+
+def spamscore_rules(count: int) -> list[dict]:
+    """Mostly body/subject substrings that never match, a few hash/email rules."""
+    rules = []
+    for i in range(count):
+        kind = i % 4
+        rules.append(
+            {
+                'score': float(1 + i % 50),
+                'email': f'spammer{i}@bad.example' if kind == 0 else None,
+                'subject': f'cheap offer {i}' if kind == 1 else None,
+                'body': f'unsubscribe-token-{i}' if kind == 2 else None,
+                'body_hash': f'{i:032x}' if kind == 3 else None,
+                'comment': f'bench rule {i}',
+            }
+        )
+    return rules
@@ -0,0 +1,154 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bench import fixtures
+
+#
+# Local stand-in for Cerberus, Guru, rspamd and Telegram
+#
+
+
+class FakeServer:
+    """Serves fixtures on 127.0.0.1, `latency` seconds added to every response.
+
+    Worklists and the Guru list are set by the benchmark through `buckets`
+    and `guru_rows`, everything else is generated from the request url.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        # {bucket_id: (bucket name, [(ticket index, updated_at)])}
+        self.buckets = {}
+        # {bucket_id: 'asc' | 'desc'}, by updated_at, unsorted until viewSortBy
+        self.bucket_sort = {}
+        # [(ticket index, lastActivity)]
+        self.guru_rows = []
+        self.requests = 0
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def route(self, method: str, path: str, query: dict, body: bytes) -> str:
+        if method == 'GET' and path == '/ajax.php':
+            action = query.get('a')
+            if action in ('viewRefresh', 'viewPage', 'viewSortBy'):
+                bucket_id = int(query['id'].removeprefix('cust_'))
+                if action == 'viewSortBy':
+                    # same column toggles, like cerb
+                    self.bucket_sort[bucket_id] = (
+                        'desc' if self.bucket_sort.get(bucket_id) == 'asc' else 'asc'
+                    )
+                return self.worklist_page(bucket_id, int(query.get('page', 0)))
+            if action == 'showConversation':
+                return fixtures.conversation(int(query['ticket_id']))
+            if query.get('action') == 'showMessageFullHeadersPopup':
+                return fixtures.headers_popup(int(query['id']))
+
+        if method == 'GET':
+            if match := re.match(r'/index.php/profiles/ticket/BN-(\d+)-\d+/', path):
+                return fixtures.profile(int(match.group(1)) - 10000)
+            if match := re.match(r'/index.php/files/(\d+)/original_message.html', path):
+                return fixtures.original_message(int(match.group(1)))
+
+        if method == 'POST':
+            if path == '/index.php/':
+                return 'ok'
+            if path == '/ticket/search':
+                return self.guru_page(json.loads(body))
+            if path.startswith('/rspamd'):
+                return fixtures.rspamd_result()
+            if path.endswith('/sendMessage'):
+                return '{"ok": true, "result": {}}'
+
+        raise LookupError(f'{method} {path}')
+
+    def worklist_page(self, bucket_id: int, page: int) -> str:
+        name, rows = self.buckets[bucket_id]
+        if bucket_id in self.bucket_sort:
+            rows = sorted(
+                rows,
+                key=lambda row: row[1],
+                reverse=self.bucket_sort[bucket_id] == 'desc',
+            )
+        start = page * fixtures.PAGE_SIZE
+        return fixtures.worklist(
+            bucket_id,
+            name,
+            rows[start : start + fixtures.PAGE_SIZE],
+            page=page,
+            total=len(rows),
+        )
+
+    def guru_page(self, query: dict) -> str:
+        rows = sorted(self.guru_rows, key=lambda row: row[1], reverse=True)
+        if 'limit' in query:
+            start = (query.get('page', 1) - 1) * query['limit']
+            rows = rows[start : start + query['limit']]
+        return fixtures.guru_list(rows)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, dont wait for delayed ack
+            disable_nagle_algorithm = True
+
+            def _reply(self, method):
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                body = self._read_body()
+                server.requests += 1
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                try:
+                    data = server.route(method, parts.path, query, body).encode()
+                    code = 200
+                except LookupError as e:
+                    data = str(e).encode()
+                    code = 404
+
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> bytes:
+                if self.headers.get('Transfer-Encoding') == 'chunked':
+                    chunks = []
+                    while size := int(self.rfile.readline().split(b';')[0], 16):
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                    self.rfile.readline()
+                    return b''.join(chunks)
+
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_GET(self):
+                self._reply('GET')
+
+            def do_POST(self):
+                self._reply('POST')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,103 +1,175 @@
 import logging
 import os
-import sys
+import signal
+import socket
+from dataclasses import replace
 from datetime import datetime
-from time import sleep
+from functools import partial
 
 from dotenv import load_dotenv
 
+# DATABASE_URL and proxies are read from env on import
 load_dotenv()
 
+from app.config import Config, ConfigWatcher
 from app.db import Base, engine, get_db
+from app.http_client import close_sessions
+from app.http_client import configure as configure_http
+from app.logger import setup_logging
+from app.metrics import metrics, start_metrics_server
 from app.notification.telegram import Telegram
+from app.poller import Poller
+from app.retention import Retention
+from app.scheduler import Scheduler
+from app.sharding import Shard
 from app.tsystem.cerb import Cerb
 from app.tsystem.guru import Guru
 from app.utils import am_i_working_now
 
 log = logging.getLogger()
-log.setLevel(logging.DEBUG)
-log_formatter = logging.Formatter('[%(asctime)s][%(name)s][%(levelname)s][%(message)s]')
 
-# stdout handler
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.INFO)
-handler.setFormatter(log_formatter)
+# .env reparsed only when changed or on SIGHUP
+config_watcher = ConfigWatcher('.env')
 
-# file handler
-fileHandler = logging.FileHandler('app.log')
-fileHandler.setFormatter(log_formatter)
+# shift schedule start for am_i_working_now
+CYCLE_START = datetime(2025, 9, 11)
 
-log.addHandler(fileHandler)
-log.addHandler(handler)
+# app.config.TICKET_SYSTEMS kinds
+SYSTEM_CLASSES = {'cerb': Cerb, 'guru': Guru}
 
-# Disable url3lib debug msg
-logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+# SIGTERM handler
+def _terminate(*_):
+    raise SystemExit(0)
+
+
+# autoclose auto, closing only on work hours
+def effective_config(config: Config) -> Config:
+    if config.cerb.autoclose != 'auto':
+        return config
+    working = am_i_working_now(cycle_start=CYCLE_START) is not False
+    return replace(config, cerb=replace(config.cerb, autoclose='1' if working else '0'))
 
 
 def main():
+    config = effective_config(config_watcher.get())
+
+    # logs written by a background thread, app.log rotated by size
+    # set up here, parse worker processes import this module too
+    log_listener = setup_logging(
+        level=config.log_level,
+        file_path=config.log_file,
+        max_bytes=config.log_max_mb * 1024 * 1024,
+        backup_count=config.log_backups,
+        json_format=config.log_format == 'json',
+    )
+
+    # Disable url3lib debug msg
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+    # pool size and default timeouts of http sessions
+    configure_http(config.http)
+
     # create tables
     Base.metadata.create_all(engine)
+    config_watcher.install_sighup()
 
     # init ticket systems
     ticket_systems = [
-        Cerb(
-            token=os.getenv('MJ_CERBERUS_TOKEN'),
-            buckets=[
-                600,  # Service
-                601,  # Support
-                # 1175, # Admin
-                # 1972, # Noc
-            ],
-        ),
-        Guru(
-            token=os.getenv('MJ_GURU_TOKEN'),
-            query_data={
-                'query': 'статус:1,4 отдел:2,6 панель:mjd,md ',
-                'counters': {'4': 'отдел:2,6 статус:4'},
-                'sort': {'field': 'byactivity', 'order': -1},
-            },
-        ),
-        Guru(
-            token=os.getenv('MC_GURU_TOKEN'),
-            query_data={
-                'query': 'статус:1,4 отдел:2,6 панель:mch,mc,myrw ',
-                'counters': {'4': 'отдел:2,6 статус:4'},
-                'sort': {'field': 'byactivity', 'order': -1},
-            },
-        ),
+        SYSTEM_CLASSES[system.kind](config, system) for system in config.ticket_systems
     ]
+    # SIGHUP also reloads cached spamscore_list
+    for ticket_system in ticket_systems:
+        config_watcher.on_hup(ticket_system.reload)
 
     # notification handler
-    notification = Telegram(
-        token=os.getenv('TELEGRAM_TOKEN'), chat_id=os.getenv('TELEGRAM_CHAT_ID')
+    notification = Telegram(config.telegram)
+
+    # poll interval per ticket system/bucket
+    scheduler = Scheduler(
+        config.poll,
+        is_working=partial(am_i_working_now, cycle_start=CYCLE_START),
+    )
+
+    # several workers share sources by db leases
+    shard = None
+    if config.sharding:
+        shard = Shard(
+            worker_id=config.shard_worker_id or f'{socket.gethostname()}:{os.getpid()}',
+            lease_ttl=config.shard_lease_ttl,
+        )
+
+    # concurrent fetch of all ticket systems/buckets
+    poller = Poller(
+        ticket_systems,
+        scheduler=scheduler,
+        max_workers=config.poll.workers,
+        shard=shard,
+        source_timeout=config.poll.source_timeout,
+        cycle_timeout=config.poll.cycle_timeout,
     )
 
+    # idle tickets moved to the archive table, disabled by default
+    retention = Retention(
+        days=config.retention_days, interval=config.retention_interval
+    )
+
+    # prometheus /metrics, disabled by default
+    if config.metrics_port:
+        start_metrics_server(config.metrics_port, config.metrics_host)
+
+    # SIGTERM stops like Ctrl-C, through the shutdown below
+    signal.signal(signal.SIGTERM, _terminate)
+
     # Main loop
-    while True:
-        # update env every loop
-        load_dotenv(override=True)
-
-        # update autoclose var on work/non work days
-        if os.getenv('ENABLE_AUTOCLOSE') == 'auto':
-            if am_i_working_now(cycle_start=datetime(2025, 9, 11)) is False:
-                os.environ['ENABLE_AUTOCLOSE'] = '0'
-            else:
-                os.environ['ENABLE_AUTOCLOSE'] = '1'
-
-        try:
-            with get_db() as db_session:
-                for ticket_system in ticket_systems:
-                    for ticket in ticket_system.process_tickets(db_session):
-                        # skip notify
-                        if ticket.spam_score <= int(os.getenv('NOTIFY_MAX_SCORE')):
-                            notification.notify(ticket)
-
-        except Exception as e:
-            log.error(e)
-        except KeyboardInterrupt:
-            exit()
-        finally:
-            sleep(int(os.getenv('SLEEP_TIME')))
+    try:
+        while True:
+            # apply changed .env, autoclose switch on work/non work hours
+            new_config = effective_config(config_watcher.get())
+            if new_config != config:
+                config = new_config
+                for ticket_system, system in zip(
+                    ticket_systems, config.ticket_systems, strict=True
+                ):
+                    ticket_system.configure(config, system)
+                configure_http(config.http)
+                notification.configure(config.telegram)
+                scheduler.configure(config.poll)
+                poller.source_timeout = config.poll.source_timeout
+                poller.cycle_timeout = config.poll.cycle_timeout
+                retention.days = config.retention_days
+                retention.interval = config.retention_interval
+
+            try:
+                with metrics.timer('cycle_seconds'):
+                    with get_db() as db_session:
+                        for ticket in poller.poll(db_session):
+                            # skip notify
+                            if ticket.spam_score <= config.notify_max_score:
+                                notification.notify(ticket)
+                                metrics.inc(
+                                    'tickets_total',
+                                    system=ticket.system_name,
+                                    state='notified',
+                                )
+
+                    poller.commit_changes()
+
+                retention.run()
+
+            except Exception as e:
+                poller.rollback_changes()
+                log.error(e)
+
+            poller.wait()
+    except KeyboardInterrupt:
+        log.info('interrupted, shutting down')
+    finally:
+        # leases released, queued notifications sent, logs flushed
+        poller.shutdown()
+        notification.close()
+        close_sessions()
+        log_listener.stop()
 
 
 if __name__ == '__main__':
@@ -10,7 +10,7 @@ DROP TABLE IF EXISTS `tickets`;
 CREATE TABLE `tickets` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `system_name` varchar(16) NOT NULL,
-  `mask` varchar(16) NOT NULL,
+  `mask` varchar(64) NOT NULL,
   `group` varchar(16) NOT NULL,
   `subject` varchar(255) NOT NULL,
   `url` varchar(255) NOT NULL,
@@ -18,11 +18,31 @@ CREATE TABLE `tickets` (
   `created_at` datetime NOT NULL,
   `updated_at` datetime NOT NULL,
   `spam_score` float NOT NULL,
+  `autoclose` varchar(16) DEFAULT NULL,
   PRIMARY KEY (`id`),
   UNIQUE KEY `ix_tickets_mask` (`mask`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
 
 
+DROP TABLE IF EXISTS `tickets_archive`;
+CREATE TABLE `tickets_archive` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `system_name` varchar(16) NOT NULL,
+  `mask` varchar(64) NOT NULL,
+  `group` varchar(16) NOT NULL,
+  `subject` varchar(255) NOT NULL,
+  `url` varchar(255) NOT NULL,
+  `user` varchar(255) NOT NULL,
+  `created_at` datetime NOT NULL,
+  `updated_at` datetime NOT NULL,
+  `spam_score` float NOT NULL,
+  `autoclose` varchar(16) DEFAULT NULL,
+  `archived_at` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_tickets_archive_mask` (`mask`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+
 DROP TABLE IF EXISTS `ticket_spamscore_list`;
 CREATE TABLE `ticket_spamscore_list` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
@@ -36,4 +56,24 @@ CREATE TABLE `ticket_spamscore_list` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
 
 
+DROP TABLE IF EXISTS `ticket_source_leases`;
+CREATE TABLE `ticket_source_leases` (
+  `source` varchar(128) NOT NULL,
+  `owner` varchar(64) DEFAULT NULL,
+  `expires_at` datetime NOT NULL,
+  PRIMARY KEY (`source`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+
+DROP TABLE IF EXISTS `ticket_claims`;
+CREATE TABLE `ticket_claims` (
+  `mask` varchar(64) NOT NULL,
+  `updated_at` datetime NOT NULL,
+  `owner` varchar(64) NOT NULL,
+  `created_at` datetime NOT NULL,
+  PRIMARY KEY (`mask`,`updated_at`),
+  KEY `ix_ticket_claims_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+
 -- 2025-09-14 02:47:22 UTC
\ No newline at end of file